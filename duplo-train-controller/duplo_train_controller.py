@@ -1,15 +1,22 @@
 #!/usr/bin/env python3
 
 import asyncio
+import collections
+import datetime
+import functools
+import os
+import re
 import sys
 from bleak import BleakScanner, BleakClient
 from bleak.exc import BleakError
 import struct
 import logging
-import select
+import mmap
 import threading
 import termios
 import tty
+from dataclasses import dataclass
+from typing import Final
 
 # Configure logging - reduce Bleak's verbosity
 logging.basicConfig(level=logging.INFO)
@@ -24,20 +31,148 @@ SERVICE_UUID = "00001623-1212-efde-1623-785feabcd123"
 CHARACTERISTIC_UUID = "00001624-1212-efde-1623-785feabcd123"
 
 # Port IDs - Updated based on actual device discovery
-MOTOR_PORT = 0x32      # Port 50 - Duplo Train Motor
-SPEAKER_PORT = 0x01
-LED_PORT = 0x11
-VOLTAGE_PORT = 0x3B
-CURRENT_PORT = 0x3C
+MOTOR_PORT: Final = 0x32      # Port 50 - Duplo Train Motor
+SPEAKER_PORT: Final = 0x01
+LED_PORT: Final = 0x11
+VOLTAGE_PORT: Final = 0x3B
+CURRENT_PORT: Final = 0x3C
 
 # Message types
-MSG_HUB_PROPERTIES = 0x01
-MSG_HUB_ACTIONS = 0x02
-MSG_HUB_ATTACHED_IO = 0x04
-MSG_PORT_INFORMATION_REQUEST = 0x21
-MSG_PORT_MODE_INFORMATION_REQUEST = 0x22
-MSG_PORT_OUTPUT_COMMAND = 0x81
-MSG_PORT_INPUT_FORMAT_SETUP_SINGLE = 0x41
+MSG_HUB_PROPERTIES: Final = 0x01
+MSG_HUB_ACTIONS: Final = 0x02
+MSG_HUB_ATTACHED_IO: Final = 0x04
+MSG_PORT_INFORMATION_REQUEST: Final = 0x21
+MSG_PORT_MODE_INFORMATION_REQUEST: Final = 0x22
+MSG_PORT_OUTPUT_COMMAND: Final = 0x81
+MSG_PORT_INPUT_FORMAT_SETUP_SINGLE: Final = 0x41
+
+# Attached I/O device types
+_DEVICE_NAMES: Final = {
+    0x0029: "Duplo Train Motor",
+    0x0014: "Voltage Sensor",
+    0x002C: "Color & Distance Sensor",
+    0x005A: "Duplo Train Base Speaker",
+    0x005B: "Duplo Train Base Light/LED"
+}
+
+# Port Output Command Feedback values
+_FEEDBACK_MSGS: Final = {
+    0x01: "Buffer Empty/Command In Progress",
+    0x05: "Command Discarded",
+    0x0A: "Command Completed",
+    0x10: "Idle"
+}
+
+# "event,volume" lines in the command files written by D, R and W
+_EVENT_LINE_RE: Final = re.compile(rb"^[ \t]*(\d+)[ \t]*,[ \t]*(\d+)[ \t]*\r?$", re.M)
+
+# Common message header: [length, hub_id]
+_HDR = struct.Struct("<BB")
+
+# Little-endian uint16 / int32 decoders for notification fields
+_U16LE = struct.Struct("<H").unpack_from
+_I32LE = struct.Struct("<i").unpack_from
+
+# Output command feedback for the motor port, ignored by the sweep handlers
+_MOTOR_FEEDBACK: Final = bytes.fromhex("050082340a")
+
+# Simple direct motor command prefix (length header added by send_command)
+_OUTPUT_HDR: Final = bytes([
+    MSG_PORT_OUTPUT_COMMAND,  # 0x81
+    MOTOR_PORT,               # Motor port
+    0x01,                     # Startup info - must be 0x01 for Duplo
+    0x51,                     # WriteDirectModeData
+    0x00,                     # Mode
+])
+
+# Full direct motor command prefix: [length, hub_id] + _OUTPUT_HDR
+_MOTOR_PREFIX: Final = bytes([0x08, 0x00]) + _OUTPUT_HDR
+
+# EVENTS mode command prefix: [length, hub_id, 0x81, sound port, startup, 0x51, mode]
+_EVENTS_PREFIX: Final = bytes([0x09, 0x00, 0x81, 0x34, 0x11, 0x51, 0x01])
+
+# Two-digit hex for every byte value, and the EVENTS prefix as hex, for formatting large result lists
+_HEX2: Final = tuple(f"{i:02x}" for i in range(256))
+_EVENTS_PREFIX_HEX: Final = _EVENTS_PREFIX.hex()
+
+# Reused EVENTS command templates: 2-byte [event, volume] and 3-byte [event, volume, param]
+_EVENTS_FRAME = bytearray(_EVENTS_PREFIX + bytes(2))
+_EVENTS3_FRAME = bytearray(b"\x0a" + _EVENTS_PREFIX[1:] + bytes(3))
+_PACK_EV2 = struct.Struct("BB").pack_into
+_PACK_EV3 = struct.Struct("BBB").pack_into
+
+def _events_frame(event, volume, param=None):
+    """EVENTS command for (event, volume[, param]), filled into a reused template"""
+    if param is None:
+        _PACK_EV2(_EVENTS_FRAME, 7, event, volume)
+        return bytes(_EVENTS_FRAME)
+    _PACK_EV3(_EVENTS3_FRAME, 7, event, volume, param)
+    return bytes(_EVENTS3_FRAME)
+
+_EVENTS_FRAME_LEN: Final = len(_EVENTS_FRAME)
+
+@functools.cache
+def _events_table():
+    """Read-only view of every 2-byte EVENTS frame back to back, indexed by event << 8 | volume"""
+    return memoryview(b"".join(_EVENTS_PREFIX + bytes((e, v)) for e in range(256) for v in range(256)))
+
+def _table_frame(event, volume):
+    """Zero-copy slice of the EVENTS frame for (event, volume) from _events_table"""
+    offset = (event << 8 | volume) * _EVENTS_FRAME_LEN
+    return _events_table()[offset:offset + _EVENTS_FRAME_LEN]
+
+# Prebuilt EVENTS mode hotkey commands: 0900813411510[event][volume]
+_CMD_FORWARD = bytes.fromhex("090081341151010101")   # Event 1, Volume 1
+_CMD_BACKWARD = bytes.fromhex("090081341151010201")  # Event 2, Volume 1
+_CMD_STOP = bytes.fromhex("090081341151010701")      # Event 7, Volume 1
+
+# Port Input Format Setup (0x41) with a delta of 1: voltage (0x35 mode 0) and motion count (0x36 mode 1)
+_SUB_V: Final = bytes.fromhex("0a004135000100000001")
+_UNSUB_V: Final = bytes.fromhex("0a004135000100000000")
+_SUB_M_COUNT: Final = bytes.fromhex("0a004136010100000001")
+_UNSUB_M_COUNT: Final = bytes.fromhex("0a004136010100000000")
+
+# Run with --bulk to pack several EVENTS frames into each sweep write. Only useful if the hub
+# parses back-to-back messages in one ATT write, so it stays opt-in
+_BULK_WRITES: Final = "--bulk" in sys.argv[1:]
+_ATT_HEADER_LEN: Final = 3  # ATT opcode + handle, taken out of the MTU
+
+def _port_info_match(port, info_type):
+    """Match a Port Information (0x43) response, or an error"""
+    return lambda d: len(d) >= 5 and (
+        d[2] == 0x05 or (d[2] == 0x43 and d[3] == port and d[4] == info_type)
+    )
+
+def _port_mode_info_match(port, mode, info_type):
+    """Match a Port Mode Information (0x44) response, or an error"""
+    return lambda d: len(d) >= 5 and (
+        d[2] == 0x05 or (len(d) >= 6 and d[2] == 0x44 and d[3] == port and d[4] == mode and d[5] == info_type)
+    )
+
+@functools.lru_cache(maxsize=64)
+def _describe_response(data):
+    """(hex, verdict) for a notification; sweeps see the same few responses over and over"""
+    hexed = data.hex()
+    
+    # Check for error responses
+    if data == b"\x05\x00\x05\x01\x06":
+        return hexed, "ERROR: Invalid use (0x06)"
+    elif data == b"\x05\x00\x05\x01\x05":
+        return hexed, "ERROR: Command not recognized (0x05)"
+    elif data == b"\x05\x00\x05\x02\x06":
+        return hexed, "ERROR: Invalid use for Hub Action (0x06)"
+    elif data[:3] == b"\x05\x00\x05":
+        # Generic error format
+        if len(data) >= 5:
+            return hexed, f"ERROR: Command type 0x{data[3]:02x}, Error code 0x{data[4]:02x}"
+    elif data[:2] == b"\x05\x00":
+        # Possible success or other message
+        return hexed, f"Response: {hexed}"
+    else:
+        # Non-error response
+        return hexed, f"Success/Data: {hexed}"
+    
+    return hexed, f"Unknown response: {hexed}"
 
 class DuploTrainController:
     def __init__(self):
@@ -47,6 +182,29 @@ class DuploTrainController:
         self.speaker_port = None
         self.led_port = None
         self.last_notification = None
+        self.recent_notifications = collections.deque(maxlen=16)  # Raw packets, hex-encoded only when shown
+        self.notification_event = asyncio.Event()  # Set on every packet; clear before sending to wait for the reply
+        self.characteristic = CHARACTERISTIC_UUID  # Resolved to a handle on connect
+        self.write_response = True  # False once write-without-response is known to work
+        self.mtu = 23  # ATT MTU, updated on connect
+        self.disconnected = asyncio.Event()  # Set by bleak's disconnect callback
+        self._send_buf = bytearray(32)  # Reused by send_command
+        self._pending_responses = {}  # (port, mode, info_type) -> asyncio.Event
+        self._response_event = asyncio.Event()  # Set when _response_filter matches
+        self._response_filter = None
+        self._dbg_on = False  # DEBUG check cached by notification_handler
+        self.value_stream = collections.deque(maxlen=256)  # Recent (port, value) samples
+        self._values_ready = asyncio.Event()  # Set when value_stream is half full
+        
+        # Notification handlers by message type, most frequent first
+        self._handlers = {
+            0x45: self._on_port_value,       # Port Value (Single)
+            0x82: self._on_output_feedback,  # Port Output Command Feedback
+            0x04: self._on_attached_io,      # Hub Attached I/O
+            0x44: self._on_port_mode_info,   # Port Mode Information
+            0x43: self._on_port_info,        # Port Information
+            0x05: self._on_error,            # Generic Error Messages
+        }
         
     async def scan_for_trains(self):
         """Scan for LEGO Duplo trains"""
@@ -65,97 +223,191 @@ class DuploTrainController:
     
     async def notification_handler(self, sender, data):
         """Handle notifications from the train"""
-        logger.debug(f"Notification from {sender}: {data.hex()}")
+        # Check the level once per packet; the _on_* handlers reuse it
+        self._dbg_on = dbg_on = logger.isEnabledFor(logging.DEBUG)
+        if dbg_on:
+            logger.debug("Notification from %s: %s", sender, data.hex())
         
         # Store last notification for test evaluation
         self.last_notification = data
+        self.recent_notifications.append(data)
+        self.notification_event.set()
         
-        # Parse message type
-        if len(data) >= 3:
-            msg_type = data[2]
-            if msg_type == 0x04:  # Port information
-                port = data[3]
-                event = data[4]
-                if event == 0x01:  # Attached
-                    device_type = data[5] | (data[6] << 8) if len(data) > 6 else data[5]
-                    logger.info(f"Device attached on port {port:02x}: type {device_type:04x}")
-                    
-                    # Track motor and other device ports
-                    device_names = {
-                        0x0029: "Duplo Train Motor",
-                        0x0014: "Voltage Sensor",
-                        0x002C: "Color & Distance Sensor", 
-                        0x005A: "Duplo Train Base Speaker",
-                        0x005B: "Duplo Train Base Light/LED"
-                    }
-                    
-                    device_name = device_names.get(device_type, f"Unknown (0x{device_type:04x})")
-                    logger.info(f"{device_name} found on port {port:02x}")
-                    
-                    if device_type == 0x0029:  # Duplo Train Motor
-                        self.motor_port = port
-                    elif device_type == 0x005B:  # LED Light
-                        self.led_port = port
-            elif msg_type == 0x05:  # Error message
-                if len(data) >= 6:
-                    cmd_type = data[3]
-                    error_code = data[4]
-                    logger.warning(f"Error response: cmd_type={cmd_type:02x}, error={error_code:02x}")
-            elif msg_type == 0x82:  # Port Output Command Feedback
-                if len(data) >= 5:
-                    port = data[3]
-                    feedback = data[4]
-                    feedback_msgs = {
-                        0x01: "Buffer Empty/Command In Progress",
-                        0x05: "Command Discarded",
-                        0x0A: "Command Completed",
-                        0x10: "Idle"
-                    }
-                    feedback_msg = feedback_msgs.get(feedback, f"Unknown ({feedback:02x})")
-                    logger.info(f"Motor feedback from port {port:02x}: {feedback_msg}")
-            elif msg_type == 0x43:  # Port information response
-                if len(data) >= 6:
-                    port = data[3]
-                    info_type = data[4]
-                    if info_type == 0x01 and len(data) >= 11:  # Port capabilities
-                        capabilities = data[5]
-                        total_modes = data[6]
-                        input_modes = data[7] | (data[8] << 8)
-                        output_modes = data[9] | (data[10] << 8)
-                        logger.info(f"Port {port:02x} capabilities: {total_modes} modes, cap={capabilities:02x}")
-            elif msg_type == 0x44:  # Port mode information response
-                if len(data) >= 6:
-                    port = data[3]
-                    mode = data[4]
-                    info_type = data[5]
-                    if info_type == 0x00:  # NAME
-                        name = data[6:].decode('ascii', errors='ignore').rstrip('\x00')
-                        logger.info(f"Port {port:02x} mode {mode}: {name}")
-                    elif info_type == 0x80:  # VALUE FORMAT
-                        if len(data) >= 11:
-                            num_values = data[6]
-                            data_type = data[7]
-                            total_figures = data[8]
-                            decimals = data[9]
-                            logger.info(f"Port {port:02x} mode {mode} format: {num_values} values, type={data_type}")
-            elif msg_type == 0x45:  # Port Value (Single)
-                if len(data) >= 5:
-                    port = data[3]
-                    # The value data starts at byte 4, length depends on port
-                    value_data = data[4:]
-                    logger.debug(f"Port {port:02x} value: {value_data.hex()}")
+        # Too short to carry a message type
+        if len(data) < 3:
+            return
+        
+        # Dispatch on message type
+        handler = self._handlers.get(data[2])
+        if handler is not None:
+            handler(data)
+        
+        # Wake _send_and_wait if this is the response it is waiting for
+        if self._response_filter is not None and self._response_filter(data):
+            self._response_event.set()
+    
+    def _on_attached_io(self, data):
+        """Handle Hub Attached I/O (0x04)"""
+        port = data[3]
+        event = data[4]
+        if event == 0x01:  # Attached
+            device_type = _U16LE(data, 5)[0] if len(data) > 6 else data[5]
+            _info = logger.info
+            _info(f"Device attached on port {port:02x}: type {device_type:04x}")
+            
+            # Track motor and other device ports
+            device_name = _DEVICE_NAMES.get(device_type)
+            if device_name is None:
+                device_name = f"Unknown (0x{device_type:04x})"
+            _info(f"{device_name} found on port {port:02x}")
+            
+            if device_type == 0x0029:  # Duplo Train Motor
+                self.motor_port = port
+            elif device_type == 0x005B:  # LED Light
+                self.led_port = port
+    
+    def _on_error(self, data):
+        """Handle Generic Error Messages (0x05)"""
+        if len(data) >= 6:
+            cmd_type = data[3]
+            error_code = data[4]
+            logger.warning(f"Error response: cmd_type={cmd_type:02x}, error={error_code:02x}")
+    
+    def _on_output_feedback(self, data):
+        """Handle Port Output Command Feedback (0x82)"""
+        if len(data) >= 5:
+            port = data[3]
+            feedback = data[4]
+            feedback_msg = _FEEDBACK_MSGS.get(feedback)
+            if feedback_msg is None:
+                feedback_msg = f"Unknown ({feedback:02x})"
+            logger.info(f"Motor feedback from port {port:02x}: {feedback_msg}")
+    
+    def _on_port_info(self, data):
+        """Handle Port Information (0x43)"""
+        if len(data) >= 6:
+            port = data[3]
+            info_type = data[4]
+            self._resolve_response((port, None, info_type))
+            if info_type == 0x01 and len(data) >= 11:  # Port capabilities
+                capabilities = data[5]
+                total_modes = data[6]
+                input_modes = _U16LE(data, 7)[0]
+                output_modes = _U16LE(data, 9)[0]
+                logger.info(f"Port {port:02x} capabilities: {total_modes} modes, cap={capabilities:02x}")
+    
+    def _on_port_mode_info(self, data):
+        """Handle Port Mode Information (0x44)"""
+        if len(data) >= 6:
+            port = data[3]
+            mode = data[4]
+            info_type = data[5]
+            self._resolve_response((port, mode, info_type))
+            if info_type == 0x00:  # NAME
+                name = data[6:].decode('ascii', errors='ignore').rstrip('\x00')
+                logger.info(f"Port {port:02x} mode {mode}: {name}")
+            elif info_type == 0x80:  # VALUE FORMAT
+                if len(data) >= 11:
+                    num_values = data[6]
+                    data_type = data[7]
+                    total_figures = data[8]
+                    decimals = data[9]
+                    logger.info(f"Port {port:02x} mode {mode} format: {num_values} values, type={data_type}")
+    
+    def _on_port_value(self, data):
+        """Handle Port Value (Single) (0x45)"""
+        if len(data) >= 5:
+            port = data[3]
+            # The value data starts at byte 4, length depends on port
+            value_data = bytes(data[4:])
+            stream = self.value_stream
+            stream.append((port, value_data))
+            if len(stream) >= stream.maxlen // 2:
+                self._values_ready.set()
+            if self._dbg_on:
+                logger.debug("Port %02x value: %s", port, value_data.hex())
+    
+    async def drain_values(self, timeout=1.0):
+        """Yield batches of buffered (port, value) samples
+        
+        A batch is yielded when the buffer is half full or every timeout
+        seconds, so it may be empty.
+        """
+        while True:
+            try:
+                await asyncio.wait_for(self._values_ready.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+            self._values_ready.clear()
+            batch = list(self.value_stream)
+            self.value_stream.clear()
+            yield batch
+    
+    def _resolve_response(self, key):
+        """Wake anyone waiting for the given information response"""
+        event = self._pending_responses.pop(key, None)
+        if event is not None:
+            event.set()
+    
+    async def send_queries(self, queries, timeout=1.0):
+        """Send a batch of information requests and wait for their responses
+        
+        queries: list of (response_key, command) where response_key is
+        (port, mode, info_type) and mode is None for port information.
+        Returns the number of responses received before the timeout.
+        """
+        events = []
+        for key, _ in queries:
+            event = asyncio.Event()
+            self._pending_responses[key] = event
+            events.append(event)
+        
+        try:
+            await asyncio.gather(*(
+                self.client.write_gatt_char(self.characteristic, command)
+                for _, command in queries
+            ))
+            await asyncio.wait_for(asyncio.gather(*(event.wait() for event in events)), timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            for key, _ in queries:
+                self._pending_responses.pop(key, None)
+        
+        return sum(event.is_set() for event in events)
     
     async def connect(self, device):
         """Connect to the train"""
         self.device = device
-        self.client = BleakClient(device.address)
+        self.disconnected.clear()
+        self.client = BleakClient(device.address, disconnected_callback=self._on_disconnect)
         
         try:
             await self.client.connect()
             logger.info(f"Connected to {device.name}")
+            logger.debug(f"Event loop: {asyncio.get_running_loop().__class__}")
+            
+            # Resolve the characteristic once so writes skip the UUID lookup
+            self.characteristic = (
+                self.client.services.get_characteristic(CHARACTERISTIC_UUID) or CHARACTERISTIC_UUID
+            )
+            
+            # Fire-and-forget motor/LED/sound commands when the hub supports it
+            properties = getattr(self.characteristic, "properties", ())
+            self.write_response = "write-without-response" not in properties
+            
+            # BlueZ only reports the exchanged MTU after it has been acquired
+            acquire_mtu = getattr(self.client._backend, "_acquire_mtu", None)
+            if acquire_mtu is not None:
+                try:
+                    await acquire_mtu()
+                except Exception as e:
+                    logger.debug(f"Could not acquire MTU: {e}")
+            self.mtu = self.client.mtu_size
+            logger.debug(f"ATT MTU {self.mtu}")
             
             # Enable notifications
-            await self.client.start_notify(CHARACTERISTIC_UUID, self.notification_handler)
+            await self.client.start_notify(self.characteristic, self.notification_handler)
             
             # Send hub properties request to activate the hub
             await self.activate_hub()
@@ -165,6 +417,23 @@ class DuploTrainController:
             logger.error(f"Failed to connect: {e}")
             return False
     
+    async def _send_and_wait(self, command, match, timeout=0.3, response=None):
+        """Send a command and wait until a notification satisfies match(data)
+        
+        Returns True if a matching response arrived before the timeout.
+        """
+        self._response_event.clear()
+        self._response_filter = match
+        try:
+            if not await self.send_command(command, response=response):
+                return False
+            await asyncio.wait_for(self._response_event.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            self._response_filter = None
+    
     async def activate_hub(self):
         """Send activation sequence to the hub"""
         # Just enable button notifications - don't query everything
@@ -173,8 +442,12 @@ class DuploTrainController:
             0x02,                # Property: Button
             0x02                 # Operation: Enable updates
         ])
-        await self.send_command(command)
-        await asyncio.sleep(0.5)
+        # Hub answers with a Hub Properties update for the button
+        await self._send_and_wait(
+            command,
+            lambda d: len(d) >= 4 and d[2] == MSG_HUB_PROPERTIES and d[3] == 0x02,
+            timeout=0.5,
+        )
     
     async def query_port_information(self, port):
         """Query information about a specific port"""
@@ -184,8 +457,7 @@ class DuploTrainController:
             port,                          # Port ID
             0x01                          # Information Type: Port Value
         ])
-        await self.send_command(command)
-        await asyncio.sleep(0.1)
+        await self._send_and_wait(command, _port_info_match(port, 0x01), response=True)
         
         # Also request mode combinations
         command = bytearray([
@@ -193,8 +465,7 @@ class DuploTrainController:
             port,                          # Port ID
             0x02                          # Information Type: Mode Info
         ])
-        await self.send_command(command)
-        await asyncio.sleep(0.1)
+        await self._send_and_wait(command, _port_info_match(port, 0x02), response=True)
     
     async def query_port_modes(self, port, mode=0):
         """Query mode information for a port"""
@@ -205,8 +476,7 @@ class DuploTrainController:
             mode,                               # Mode
             0x00                               # Information Type: NAME
         ])
-        await self.send_command(command)
-        await asyncio.sleep(0.1)
+        await self._send_and_wait(command, _port_mode_info_match(port, mode, 0x00), response=True)
         
         # Request value format
         command = bytearray([
@@ -215,8 +485,11 @@ class DuploTrainController:
             mode,                               # Mode
             0x80                               # Information Type: VALUE FORMAT
         ])
-        await self.send_command(command)
-        await asyncio.sleep(0.1)
+        await self._send_and_wait(command, _port_mode_info_match(port, mode, 0x80), response=True)
+    
+    def _on_disconnect(self, client):
+        """Bleak callback when the link drops, expected or not"""
+        self.disconnected.set()
     
     async def disconnect(self):
         """Disconnect from the train"""
@@ -224,78 +497,60 @@ class DuploTrainController:
             await self.client.disconnect()
             logger.info("Disconnected from train")
     
-    async def send_command(self, command):
-        """Send a command to the train"""
+    async def send_command(self, command, response=None):
+        """Send a command to the train
+        
+        response: wait for the write ACK; defaults to write_response
+        """
         if not self.client or not self.client.is_connected:
             logger.error("Not connected to train")
             return False
         
+        if response is None:
+            response = self.write_response
+        
         try:
-            # Add message length header (excluding length bytes)
-            length = len(command) + 2
-            message = bytearray([length, 0x00]) + command
+            # Add message length header, packed into the reusable send buffer
+            n = len(command)
+            if n + 2 > len(self._send_buf):
+                self._send_buf = bytearray(n + 2)
+            _HDR.pack_into(self._send_buf, 0, n + 2, 0x00)
+            self._send_buf[2:2 + n] = command
+            # Snapshot so concurrent senders can't clobber an in-flight write
+            message = bytes(memoryview(self._send_buf)[:2 + n])
             
-            logger.debug(f"Sending: {message.hex()}")
-            await self.client.write_gatt_char(CHARACTERISTIC_UUID, message)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Sending: %s", message.hex())
+            await self.client.write_gatt_char(self.characteristic, message, response=response)
             return True
         except Exception as e:
             logger.error(f"Failed to send command: {e}")
             return False
 
-    async def test2(self, speed):
-        """Set motor speed (-100 to 100)"""
-        speed = max(-100, min(100, speed))
-
-        # Convert speed to signed byte
-        if speed < 0:
-            speed_byte = 256 + speed
-        else:
-            speed_byte = speed
-
-        # Direct write to motor - simplified command
-        command = bytearray([0x08, 0x00, 0x81, 0x01, 0x11, 0x51, 0x01, 0x09])
-
-        await self.client.write_gatt_char(CHARACTERISTIC_UUID, command)
-        logger.info(f"Set motor speed to {speed}")
-
+    async def write_frame(self, frame):
+        """Write a complete frame (length header included) to the hub"""
+        await self.client.write_gatt_char(self.characteristic, frame, response=self.write_response)
+    
     async def set_motor_speed(self, speed):
         """Set motor speed (-100 to 100)"""
         speed = max(-100, min(100, speed))
+        speed_byte = speed & 0xFF  # Signed byte (two's complement)
         
-        # Convert speed to signed byte
-        if speed < 0:
-            speed_byte = (256 + speed) & 0xFF
-        else:
-            speed_byte = speed & 0xFF
-        
-        # Motor control command - Fixed to use actual speed_byte instead of hardcoded 0x32
-        command = bytes([0x08, 0x00, 0x81, MOTOR_PORT, 0x01, 0x51, 0x00, speed_byte])
-        logger.debug(f"Sending motor command: {command.hex()}")
-        logger.debug(f"Speed requested: {speed}, speed_byte: 0x{speed_byte:02x}")
-        await self.client.write_gatt_char(CHARACTERISTIC_UUID, command)
+        # Motor control command
+        command = _MOTOR_PREFIX + bytes((speed_byte,))
+        if logger.isEnabledFor(logging.DEBUG):
+            _dbg = logger.debug
+            _dbg("Sending motor command: %s", command.hex())
+            _dbg("Speed requested: %d, speed_byte: 0x%02x", speed, speed_byte)
+        await self.client.write_gatt_char(self.characteristic, command, response=self.write_response)
         logger.info(f"Set motor speed to {speed}")
     
     async def set_motor_simple(self, speed):
         """Simple motor control"""
         speed = max(-100, min(100, speed))
         
-        # Convert to signed byte
-        if speed < 0:
-            speed_byte = (256 + speed) & 0xFF
-        else:
-            speed_byte = speed & 0xFF
-            
-        # Simple direct motor command
-        command = bytearray([
-            MSG_PORT_OUTPUT_COMMAND,  # 0x81
-            MOTOR_PORT,               # 0x00
-            0x01,                     # Startup info - must be 0x01 for Duplo
-            0x51,                     # WriteDirectModeData
-            0x00,                     # Mode
-            speed_byte                # Speed
-        ])
-        
-        await self.send_command(command)
+        # Simple direct motor command, speed as signed byte
+        await self.send_command(_OUTPUT_HDR + bytes((speed & 0xFF,)))
         logger.info(f"Set motor speed (simple) to {speed}")
     
     async def stop(self):
@@ -308,32 +563,10 @@ class DuploTrainController:
     
     def evaluate_response(self, command_desc):
         """Evaluate the last notification response"""
-        if not self.last_notification:
+        data = self.last_notification
+        if not data:
             return "No response received"
-        
-        data_hex = self.last_notification.hex()
-        
-        # Check for error responses
-        if data_hex == "0500050106":
-            return f"{command_desc} - ERROR: Invalid use (0x06)"
-        elif data_hex == "0500050105":
-            return f"{command_desc} - ERROR: Command not recognized (0x05)"
-        elif data_hex == "0500050206":
-            return f"{command_desc} - ERROR: Invalid use for Hub Action (0x06)"
-        elif data_hex.startswith("050005"):
-            # Generic error format
-            if len(self.last_notification) >= 5:
-                cmd_type = self.last_notification[3]
-                error_code = self.last_notification[4]
-                return f"{command_desc} - ERROR: Command type 0x{cmd_type:02x}, Error code 0x{error_code:02x}"
-        elif data_hex.startswith("0500"):
-            # Possible success or other message
-            return f"{command_desc} - Response: {data_hex}"
-        else:
-            # Non-error response
-            return f"{command_desc} - Success/Data: {data_hex}"
-        
-        return f"{command_desc} - Unknown response: {data_hex}"
+        return f"{command_desc} - {_describe_response(bytes(data))[1]}"
     
     async def wait_for_response(self, timeout=0.3):
         """Wait for a response and clear the last notification"""
@@ -349,8 +582,9 @@ class DuploTrainController:
         # Hub Action command: [length] [0x00] [0x02=HubAction] [0x01=PlaySound] [sound_id]
         command = bytes([0x04, 0x00, 0x02, 0x01, sound_id])
         
-        logger.debug(f"Playing sound {sound_id}: {command.hex()}")
-        await self.client.write_gatt_char(CHARACTERISTIC_UUID, command)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Playing sound %d: %s", sound_id, command.hex())
+        await self.client.write_gatt_char(self.characteristic, command, response=self.write_response)
         logger.info(f"Played sound {sound_id}")
     
     async def set_light_color(self, color):
@@ -369,38 +603,458 @@ class DuploTrainController:
         ]
         
         for i, command in enumerate(commands):
-            logger.debug(f"Trying LED format {i}: {command.hex()}")
-            await self.client.write_gatt_char(CHARACTERISTIC_UUID, command)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Trying LED format %d: %s", i, command.hex())
+            await self.client.write_gatt_char(self.characteristic, command, response=self.write_response)
             await asyncio.sleep(0.5)
 
+class BatchedGattWriter:
+    """Pipeline write-without-response frames with an adaptive in-flight window"""
+    
+    GROW_AFTER = 100  # Consecutive successful writes before widening the window
+    
+    def __init__(self, controller, window=4, max_window=8, delay=0.02):
+        self.controller = controller
+        # Bound once: the writer lives for a single sweep on one connection
+        self._write = controller.client.write_gatt_char
+        self._char = controller.characteristic
+        self.window = window
+        self.max_window = max_window
+        self.delay = delay  # Max pacing per frame while waiting for feedback, applied per batch
+        self.pending = []   # (frame, task) pairs not yet awaited
+        self.successes = 0  # Writes since the last backpressure error
+        self.acked = 0      # Hub feedback messages seen for the current batch
+        self._all_acked = asyncio.Event()
+    
+    def ack(self):
+        """Called from the notification handler for each command feedback message"""
+        self.acked += 1
+        if self.pending and self.acked >= len(self.pending):
+            self._all_acked.set()
+    
+    async def write(self, frame):
+        """Queue a frame; flushes once the window is full"""
+        if not self.pending:
+            # New batch
+            self.acked = 0
+            self._all_acked.clear()
+        task = asyncio.create_task(self._write(self._char, frame, response=False))
+        self.pending.append((frame, task))
+        if len(self.pending) >= self.window:
+            await self.flush()
+    
+    async def flush(self):
+        """Wait for all queued writes and the hub's feedback for them"""
+        if not self.pending:
+            return
+        results = await asyncio.gather(*(task for _, task in self.pending), return_exceptions=True)
+        
+        # Pace on the hub's feedback for the batch, with the fixed delay as a ceiling
+        if self.acked < len(self.pending):
+            try:
+                await asyncio.wait_for(self._all_acked.wait(), len(self.pending) * self.delay)
+            except asyncio.TimeoutError:
+                pass
+        pending, self.pending = self.pending, []
+        
+        client = self.controller.client
+        backpressure = False
+        for (frame, _), result in zip(pending, results):
+            if not isinstance(result, Exception):
+                continue
+            if not isinstance(result, BleakError) or not client.is_connected:
+                raise result
+            # Adapter buffers are full - shrink the window, let them drain, resend this frame
+            backpressure = True
+            self.window = max(1, self.window // 2)
+            logger.debug(f"Write backpressure, window now {self.window}")
+            await asyncio.sleep(0.1)
+            await self._write(self._char, frame, response=False)
+        
+        if backpressure:
+            self.successes = 0
+        else:
+            self.successes += len(pending)
+        if self.successes >= self.GROW_AFTER and self.window < self.max_window:
+            self.window += 1
+            self.successes = 0
+            logger.debug(f"Writes keeping up, window now {self.window}")
+
+# Writes kept in flight by _burst_write, one below the usual controller TX buffer count of 10
+_TX_WINDOW: Final = 8
+
+async def _burst_write(controller, frames, delay=0.02, coalesce=_BULK_WRITES, window=_TX_WINDOW):
+    """Send frames write-without-response with up to window writes in flight, returning how many went out
+    
+    Each write holds its slot for delay per frame it carries, so the hub is paced while the
+    adapter queue stays full. With coalesce, frames are concatenated into writes of up to MTU - 3 bytes.
+    """
+    payload = controller.mtu - _ATT_HEADER_LEN if coalesce else 0
+    writes = []  # (data, frame count)
+    sent = 0
+    chunk = bytearray()
+    count = 0
+    for frame in frames:
+        if chunk and len(chunk) + len(frame) > payload:
+            writes.append((bytes(chunk), count))
+            chunk.clear()
+            count = 0
+        chunk += frame
+        count += 1
+        sent += 1
+    if chunk:
+        writes.append((bytes(chunk), count))
+    
+    client = controller.client
+    write = client.write_gatt_char
+    char = controller.characteristic
+    slots = asyncio.Semaphore(window)
+    
+    async def send(data, count):
+        async with slots:
+            try:
+                await write(char, data, response=False)
+            except BleakError:
+                if not client.is_connected:
+                    raise
+                # Adapter buffers are full - let them drain and resend once
+                await asyncio.sleep(0.1)
+                await write(char, data, response=False)
+            await asyncio.sleep(delay * count)
+    
+    tasks = [asyncio.create_task(send(data, count)) for data, count in writes]
+    try:
+        await asyncio.gather(*tasks)
+    except BaseException:
+        # Don't leave the remaining writes running against a dead link
+        for task in tasks:
+            task.cancel()
+        raise
+    return sent
+
+@dataclass(slots=True)
+class SweepState:
+    """Sensor tracking for one D or R run, shared with its notification handler"""
+    controller: "DuploTrainController"
+    voltage_changes: bytearray  # 8 KB command bitmaps, see _mark_commands
+    motion_changes: bytearray
+    history: collections.deque | list  # Commands a sensor change can be blamed on
+    writer: BatchedGattWriter | None = None  # D only, paced by command feedback
+    voltage_baseline: int | None = None
+    count_baseline: int | None = None
+    notification_count: int = 0
+
+def sweep_notification_handler(state, sender, data):
+    """D sweep: mark the last 5 commands sent whenever voltage or motion changes"""
+    state.notification_count += 1
+    state.controller.last_notification = data
+    
+    # Motor feedback acknowledges a command - pace on it, otherwise skip it
+    if data[:5] == _MOTOR_FEEDBACK:
+        state.writer.ack()
+        return
+    
+    # Debug first 10 non-motor notifications
+    if state.notification_count <= 10:
+        print(f"\nDEBUG [{state.notification_count}]: {data.hex()}")
+    
+    # Check message type properly
+    if len(data) >= 3:
+        msg_type = data[2]
+        if msg_type == 0x45:  # Port Value Single
+            port = data[3]
+            if port == 0x35 and len(data) >= 6:  # Voltage
+                voltage = _U16LE(data, 4)[0]
+                if state.voltage_baseline is None:
+                    state.voltage_baseline = voltage
+                    print(f"\nVoltage baseline set: {voltage}mV")
+                elif abs(voltage - state.voltage_baseline) > 100:  # 100mV threshold
+                    print(f"\n>>> Voltage change: {voltage}mV (baseline: {state.voltage_baseline}mV)")
+                    # Add last 5 commands
+                    _mark_commands(state.voltage_changes, state.history)
+                    
+            elif port == 0x36 and len(data) >= 8:  # Motion count
+                count = _I32LE(data, 4)[0]
+                if state.count_baseline is None:
+                    state.count_baseline = count
+                    print(f"\nMotion baseline set: {count}")
+                elif count != state.count_baseline:
+                    print(f"\n>>> Motion detected: count {state.count_baseline} -> {count}")
+                    # Add last 5 commands
+                    _mark_commands(state.motion_changes, state.history)
+                    state.count_baseline = count
+
+def replay_notification_handler(state, sender, data):
+    """R replay: record the command just sent whenever voltage or motion changes"""
+    state.controller.last_notification = data
+    
+    if data[:5] == _MOTOR_FEEDBACK:
+        return
+    
+    if len(data) >= 3:
+        msg_type = data[2]
+        if msg_type == 0x45:  # Port Value Single
+            port = data[3]
+            if port == 0x35 and len(data) >= 6:  # Voltage
+                voltage = _U16LE(data, 4)[0]
+                if state.voltage_baseline is None:
+                    state.voltage_baseline = voltage
+                    print(f"\nVoltage baseline: {voltage}mV")
+                elif abs(voltage - state.voltage_baseline) > 100:
+                    print(f"\n>>> Voltage change: {voltage}mV (delta: {voltage - state.voltage_baseline:+d})")
+                    _mark_commands(state.voltage_changes, state.history[-1:])
+                        
+            elif port == 0x36 and len(data) >= 8:  # Motion count
+                count = _I32LE(data, 4)[0]
+                if state.count_baseline is None:
+                    state.count_baseline = count
+                    print(f"\nMotion baseline: {count}")
+                elif count != state.count_baseline:
+                    print(f"\n>>> Motion detected: {state.count_baseline} -> {count}")
+                    _mark_commands(state.motion_changes, state.history[-1:])
+                    state.count_baseline = count
+
+_WORKING_COMMANDS_FILE: Final = "working_commands.list"
+
+# Header written by Y at the top of working_commands.list
+_WORKING_HEADER_TPL: Final = """\
+# Confirmed working commands for Duplo train
+# Generated on {ts}
+#
+# Format: full hex command (18 characters)
+# Command structure: 0900813411510[event][volume]
+#   09 = message length
+#   00 = hub ID
+#   81 = port output command
+#   34 = sound port
+#   11 = startup/completion info
+#   51 = write direct mode data
+#   01 = EVENTS mode
+#   [event] = event byte (hex)
+#   [volume] = volume byte (hex)
+#
+
+"""
+
 def load_working_commands():
-    """Load confirmed working commands from file"""
+    """Load confirmed working commands from file as packed event << 8 | volume ids"""
+    try:
+        mtime = os.stat(_WORKING_COMMANDS_FILE).st_mtime_ns
+    except FileNotFoundError:
+        return frozenset()
+    # Keyed on mtime so edits between sweeps are picked up without re-parsing otherwise
+    return _parse_working_commands(mtime)
+
+@functools.lru_cache(maxsize=1)
+def _parse_working_commands(mtime):
+    """Parse working_commands.list (cached per modification time)"""
     working_commands = set()
     try:
-        with open("working_commands.list", "r") as f:
+        with open(_WORKING_COMMANDS_FILE, "r", encoding="ascii", errors="ignore") as f:
             for line in f:
                 line = line.strip()
                 if line and not line.startswith("#"):
-                    # Handle hex format
-                    if len(line) == 18 and all(c in '0123456789abcdefABCDEF' for c in line):
-                        try:
-                            # Extract event and volume from hex command
-                            # Format: 0900813411510107c8 where 07 is event, c8 is volume
-                            event = int(line[14:16], 16)
-                            volume = int(line[16:18], 16)
-                            working_commands.add((event, volume))
-                        except:
-                            continue
                     # Handle old format (event,volume)
-                    elif ',' in line:
+                    if ',' in line:
                         try:
-                            event, volume = line.split(',')
-                            working_commands.add((int(event), int(volume)))
-                        except:
+                            event, volume = map(int, line.split(',', 1))
+                        except ValueError:
                             continue
+                        if 0 <= event <= 255 and 0 <= volume <= 255:
+                            working_commands.add(event << 8 | volume)
+                        continue
+                    # Handle hex format
+                    # Format: 0900813411510107c8 where 07 is event, c8 is volume
+                    try:
+                        cmd_bytes = bytes.fromhex(line)
+                    except ValueError:
+                        continue
+                    if len(cmd_bytes) == 9:
+                        working_commands.add(cmd_bytes[7] << 8 | cmd_bytes[8])
     except FileNotFoundError:
         pass
-    return working_commands
+    return frozenset(working_commands)
+
+def _read_command_file(path):
+    """Whole contents of a command file, re-read only when the file has changed"""
+    st = os.stat(path)
+    return _read_command_file_at(path, st.st_mtime_ns, st.st_size)
+
+@functools.lru_cache(maxsize=8)
+def _read_command_file_at(path, mtime, size):
+    """Contents of path at a given mtime/size, copied out of one read-only mmap"""
+    with open(path, "rb") as f:
+        try:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                return mm[:]
+        except ValueError:
+            return b""  # Empty files can't be mapped
+
+def _append_file(path, text):
+    """Append text to path with one encode and one O_APPEND write"""
+    fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fd, text.encode("utf-8"))
+    finally:
+        os.close(fd)
+
+def _write_file(path, text):
+    """Replace the contents of path with text"""
+    with open(path, "w") as f:
+        f.write(text)
+
+def _mark_commands(bitmap, commands):
+    """Set the bit for each (event, volume) in an 8 KB command bitmap"""
+    for event, volume in commands:
+        idx = event << 8 | volume
+        bitmap[idx >> 3] |= 1 << (idx & 7)
+
+def _bitmap_commands(bitmap):
+    """Yield (event, volume) for every set bit of a command bitmap, in order"""
+    for i, byte in enumerate(bitmap):
+        if byte:
+            for bit in range(8):
+                if byte >> bit & 1:
+                    idx = i << 3 | bit
+                    yield idx >> 8, idx & 0xFF
+
+def _drop_skipped(commands, skip_ids):
+    """Remove packed skip ids from an ordered dict of (event, volume) keys, in place"""
+    for idx in skip_ids:
+        commands.pop((idx >> 8, idx & 0xFF), None)
+
+def _bitmap_has(bitmap, event, volume):
+    """Whether (event, volume) is set in a command bitmap"""
+    idx = event << 8 | volume
+    return bitmap[idx >> 3] >> (idx & 7) & 1
+
+def _format_event_commands(commands):
+    """One block listing each (event, volume) with its EVENTS frame, for a single print()"""
+    return "\n".join(
+        f"  Event={event}, Volume={volume}\n"
+        f"    bytes([0x09, 0x00, 0x81, 0x34, 0x11, 0x51, 0x01, 0x{_HEX2[event]}, 0x{_HEX2[volume]}])"
+        for event, volume in commands
+    )
+
+def _save_manual_events(history, ranges):
+    """Write the history range behind each spacebar press to manual_events.txt"""
+    with open("manual_events.txt", "w") as f:
+        f.write("# Manual events - spacebar pressed during interesting commands\n")
+        for i, (start, end) in enumerate(ranges):
+            f.write(f"\n# Manual Event {i+1} - Last 200 commands\n")
+            for event, volume in history[start:end]:
+                f.write(f"{event},{volume}\n")
+
+def _save_shutdown_commands(commands):
+    """Write the commands sent just before a disconnection to shutdown_commands.txt"""
+    with open("shutdown_commands.txt", "w") as f:
+        f.write("# Shutdown commands - last 20 before disconnection\n")
+        for event, volume in commands:
+            f.write(f"{event},{volume}\n")
+
+async def async_input(prompt=""):
+    """input() that reads stdin off the event loop so BLE notifications keep draining"""
+    print(prompt, end="", flush=True)
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+    
+    def read_line():
+        line = sys.stdin.readline()
+        try:
+            loop.call_soon_threadsafe(lambda: future.done() or future.set_result(line))
+        except RuntimeError:
+            pass  # Loop already closed
+    
+    # Daemon thread so a pending read never blocks interpreter exit
+    threading.Thread(target=read_line, daemon=True).start()
+    line = await future
+    if not line:
+        raise EOFError
+    return line.rstrip("\n")
+
+# BlueZ debugfs knobs for the LE connection interval requested on new connections (units of 1.25 ms)
+_HCI_DEBUGFS: Final = "/sys/kernel/debug/bluetooth/hci0"
+
+def _write_debugfs(name, value):
+    with open(f"{_HCI_DEBUGFS}/{name}", "w") as f:
+        f.write(f"{value}\n")
+
+def restore_conn_interval(old):
+    """Put back the connection interval saved by tighten_conn_interval"""
+    if not old:
+        return
+    try:
+        # Max first so min never ends up above it
+        _write_debugfs("conn_max_interval", old["conn_max_interval"])
+        _write_debugfs("conn_min_interval", old["conn_min_interval"])
+    except OSError as e:
+        logger.debug(f"Could not restore connection interval: {e}")
+
+def tighten_conn_interval(min_interval=8, max_interval=9):
+    """Request a 10-11 ms connection interval from BlueZ; returns the old values, or None.
+    
+    Only new connections pick this up, so call it before connecting. Needs root and a
+    mounted debugfs; elsewhere it quietly does nothing.
+    """
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        old = {}
+        for name in ("conn_min_interval", "conn_max_interval"):
+            with open(f"{_HCI_DEBUGFS}/{name}") as f:
+                old[name] = f.read().strip()
+    except OSError as e:
+        logger.debug(f"Connection interval not adjustable: {e}")
+        return None
+    try:
+        # Min first so it never ends up above the current max
+        _write_debugfs("conn_min_interval", min_interval)
+        _write_debugfs("conn_max_interval", max_interval)
+    except OSError as e:
+        logger.debug(f"Could not tighten connection interval: {e}")
+        restore_conn_interval(old)
+        return None
+    logger.debug(f"Connection interval {min_interval}-{max_interval} (was {old})")
+    return old
+
+# Set DUPLO_VERBOSE to print the raw frames the sweeps send
+_VERBOSE: Final = bool(os.environ.get("DUPLO_VERBOSE"))
+
+# Commands carrying a value: F/B/C/S<value>, E<event> and E3/E4 <param>
+_VALUE_CMD_RE: Final = re.compile(r"([FBCSE])(\d+)(?:\s+(\S+))?", re.ASCII)
+
+# F/B/C/S<value> hotkeys: prefix -> (event, max value, action, value name)
+_PARAM_COMMANDS: Final = {
+    'F': (1, 255, "Forward with speed", "Speed"),
+    'B': (2, 255, "Backward with speed", "Speed"),
+    'C': (4, 24, "Set color to", "Color"),
+    'S': (6, 255, "Play sound", "Sound"),
+}
+
+def _param_sender(controller, event):
+    """send(value) coroutine for EVENTS (event, 1, value) that patches one byte of its own template
+    
+    Returns the frame it sent. Binds the client, so build it after connecting.
+    """
+    buf = bytearray(_EVENTS3_FRAME)
+    buf[7] = event
+    buf[8] = 1
+    write = controller.client.write_gatt_char
+    char = controller.characteristic
+    
+    async def send(value):
+        buf[9] = value
+        frame = bytes(buf)
+        await write(char, frame, response=controller.write_response)
+        return frame
+    return send
+
+# T: longest wait for the hub's reply to a command, then how long to watch for it shutting down
+_T_RESPONSE_TIMEOUT: Final = 3.0
+_T_SETTLE: Final = 0.5
+
+# Seconds each E sweep value is left running before moving on
+_E_DWELL: Final = 2.0
 
 async def interactive_control(controller):
     """Interactive control loop"""
@@ -431,36 +1085,36 @@ async def interactive_control(controller):
     print("  Y   - Confirm working commands (Yes/No for each)")
     print("  P   - Play working commands (one by one with Enter)")
     print("  A   - Analyze working commands and test variations")
-    print("  B   - Byte format testing (2-byte and 3-byte commands)")
+    print("  X   - Byte format testing (2-byte and 3-byte commands)")
     print("  N   - Next byte testing (3-byte with known working base)")
     print("  E0-E10 - Test specific event with 3-byte format")
     print("  T   - Test shutdown commands from file (one by one)")
     
+    # Specialised senders for the value hotkeys and E3/E4 <param>
+    senders = {event: _param_sender(controller, event) for event in (1, 2, 3, 4, 6)}
+    
     while True:
         try:
-            cmd = input("\nEnter command: ").strip()
+            cmd = (await async_input("\nEnter command: ")).strip()
+            value_cmd = _VALUE_CMD_RE.fullmatch(cmd)
             
             if cmd == 'q':
                 break
             elif cmd == 'f':
                 # Forward using EVENTS mode (Event 1, Volume 1)
-                cmd_bytes = bytes([0x09, 0x00, 0x81, 0x34, 0x11, 0x51, 0x01, 1, 1])
-                await controller.client.write_gatt_char(CHARACTERISTIC_UUID, cmd_bytes)
+                await controller.client.write_gatt_char(controller.characteristic, _CMD_FORWARD, response=controller.write_response)
                 print("Forward")
             elif cmd == 'F':
                 # Forward fast using EVENTS mode (Event 1, Volume 1)
-                cmd_bytes = bytes([0x09, 0x00, 0x81, 0x34, 0x11, 0x51, 0x01, 1, 1])
-                await controller.client.write_gatt_char(CHARACTERISTIC_UUID, cmd_bytes)
+                await controller.client.write_gatt_char(controller.characteristic, _CMD_FORWARD, response=controller.write_response)
                 print("Forward (fast)")
             elif cmd == 'b':
                 # Backward using EVENTS mode (Event 2, Volume 1)
-                cmd_bytes = bytes([0x09, 0x00, 0x81, 0x34, 0x11, 0x51, 0x01, 2, 1])
-                await controller.client.write_gatt_char(CHARACTERISTIC_UUID, cmd_bytes)
+                await controller.client.write_gatt_char(controller.characteristic, _CMD_BACKWARD, response=controller.write_response)
                 print("Backward")
             elif cmd == 'B':
                 # Backward fast using EVENTS mode (Event 2, Volume 1)
-                cmd_bytes = bytes([0x09, 0x00, 0x81, 0x34, 0x11, 0x51, 0x01, 2, 1])
-                await controller.client.write_gatt_char(CHARACTERISTIC_UUID, cmd_bytes)
+                await controller.client.write_gatt_char(controller.characteristic, _CMD_BACKWARD, response=controller.write_response)
                 print("Backward (fast)")
             elif cmd == 's':
                 await controller.stop()
@@ -468,8 +1122,8 @@ async def interactive_control(controller):
                 sound_id = int(cmd)
                 if sound_id in [1, 2]:
                     print(f"WARNING: Sound {sound_id} powers off the train!")
-                    confirm = input("Continue? (y/n): ")
-                    if confirm.lower() != 'y':
+                    confirm = await async_input("Continue? (y/n): ")
+                    if confirm not in ('y', 'Y'):
                         continue
                 await controller.play_sound(sound_id)
             elif cmd == 'r':
@@ -477,11 +1131,11 @@ async def interactive_control(controller):
                 print("Reading color/distance sensor...")
                 # Subscribe to port 0x36 (color/distance sensor)
                 command = bytes([0x0A, 0x00, 0x41, 0x36, 0x00, 0x01, 0x00, 0x00, 0x00, 0x01])
-                await controller.client.write_gatt_char(CHARACTERISTIC_UUID, command)
+                await controller.client.write_gatt_char(controller.characteristic, command)
                 await asyncio.sleep(1)
                 print("Check debug logs for sensor readings")
             elif cmd == 'c':
-                color = input("Enter color (0-10): ")
+                color = await async_input("Enter color (0-10): ")
                 try:
                     await controller.set_light_color(int(color))
                 except ValueError:
@@ -499,33 +1153,36 @@ async def interactive_control(controller):
                     (0x80, 0x90, "High range")
                 ]
                 
+                # Skip 0x01, 0x02, and 0x07 which power off or reset the train
+                skip_actions = {0x01, 0x02, 0x07}
+                
                 for start, end, description in test_ranges:
                     print(f"\n{description} (0x{start:02x}-0x{end:02x}):")
-                    for action_type in range(start, end):
-                        # Skip 0x01, 0x02, and 0x07 which power off or reset the train
-                        if action_type in [0x01, 0x02, 0x07]:
-                            print(f"\nSkipping action type 0x{action_type:02x} (powers off/resets)")
-                            continue
-                            
-                        print(f"\nTesting action type 0x{action_type:02x}:")
-                        
-                        # Try a few different values for each action type
-                        for value in [0x03, 0x05, 0x0A]:
-                            cmd_bytes = bytes([0x04, 0x00, 0x02, action_type, value])
-                            logger.debug(f"Hub Action: {cmd_bytes.hex()}")
-                            
-                            try:
-                                await controller.client.write_gatt_char(CHARACTERISTIC_UUID, cmd_bytes)
-                                await asyncio.sleep(0.3)
-                            except Exception as e:
-                                logger.error(f"Error with action 0x{action_type:02x}: {e}")
-                                break
-                        
-                        result = input("Any effect? (sound/led/motor/power/none/skip): ")
-                        if result == "skip":
-                            break
-                        if result != "none":
-                            print(f"✓ Action type 0x{action_type:02x}: {result}")
+                    skipped = [a for a in range(start, end) if a in skip_actions]
+                    if skipped:
+                        print("Skipping action types " + ", ".join(f"0x{a:02x}" for a in skipped) + " (powers off/resets)")
+                    
+                    # Try a few different values for each action type, whole range at once
+                    cmds = [
+                        bytes([0x04, 0x00, 0x02, action_type, value])
+                        for action_type in range(start, end) if action_type not in skip_actions
+                        for value in (0x03, 0x05, 0x0A)
+                    ]
+                    if logger.isEnabledFor(logging.DEBUG):
+                        for cmd_bytes in cmds:
+                            logger.debug("Hub Action: %s", cmd_bytes.hex())
+                    
+                    print(f"Sending {len(cmds)} Hub Actions...")
+                    try:
+                        await asyncio.gather(*(controller.write_frame(c) for c in cmds))
+                    except Exception as e:
+                        logger.error(f"Error in range 0x{start:02x}-0x{end:02x}: {e}")
+                    
+                    result = await async_input("Any effect? (sound/led/motor/power/none/skip): ")
+                    if result == "skip":
+                        break
+                    if result != "none":
+                        print(f"✓ Action range 0x{start:02x}-0x{end:02x}: {result}")
                 
                 print("\nAlso trying Hub Properties (0x01) for LED control:")
                 # Hub Properties that might control LED
@@ -542,25 +1199,27 @@ async def interactive_control(controller):
                     # Try setting property
                     for value in [0x00, 0x03, 0x05, 0x09, 0x0A]:
                         cmd_bytes = bytes([0x05, 0x00, 0x01, prop, 0x01, value])
-                        logger.debug(f"Hub Property Set: {cmd_bytes.hex()}")
-                        await controller.client.write_gatt_char(CHARACTERISTIC_UUID, cmd_bytes)
+                        if logger.isEnabledFor(logging.DEBUG):
+                            logger.debug("Hub Property Set: %s", cmd_bytes.hex())
+                        await controller.client.write_gatt_char(controller.characteristic, cmd_bytes)
                         await asyncio.sleep(0.3)
                     
-                    led_changed = input("Did LED change? (y/n): ")
-                    if led_changed.lower() == 'y':
+                    led_changed = await async_input("Did LED change? (y/n): ")
+                    if led_changed in ('y', 'Y'):
                         print(f"✓ LED controlled by property 0x{prop:02x}")
             elif cmd == '2':
                 print("Testing Hub Action 0x02 with different values...")
                 print("WARNING: This action may power off the train!")
-                confirm = input("Continue? (y/n): ")
-                if confirm.lower() == 'y':
+                confirm = await async_input("Continue? (y/n): ")
+                if confirm in ('y', 'Y'):
                     for value in range(0, 11):
                         print(f"\nTesting action 0x02 with value {value}...")
                         cmd_bytes = bytes([0x04, 0x00, 0x02, 0x02, value])
-                        logger.debug(f"Hub Action 0x02: {cmd_bytes.hex()}")
-                        await controller.client.write_gatt_char(CHARACTERISTIC_UUID, cmd_bytes)
+                        if logger.isEnabledFor(logging.DEBUG):
+                            logger.debug("Hub Action 0x02: %s", cmd_bytes.hex())
+                        await controller.client.write_gatt_char(controller.characteristic, cmd_bytes)
                         await asyncio.sleep(1)
-                        effect = input("Effect? (power_off/sound/led/none): ")
+                        effect = await async_input("Effect? (power_off/sound/led/none): ")
                         if effect == "power_off":
                             print("Train powered off. You may need to reconnect.")
                             break
@@ -581,58 +1240,43 @@ async def interactive_control(controller):
                     0x36: "Color/Distance Sensor"
                 }
                 
+                # Mode information types: NAME, VALUE FORMAT, RAW range, SI range
+                mode_info_types = (0x00, 0x80, 0x01, 0x03)
+                
+                # Build every probe up front, keyed by the response it expects
+                port_probes = {
+                    port: [
+                        ((port, None, 0x01), bytes([0x05, 0x00, 0x21, port, 0x01])),  # Port Value
+                        ((port, None, 0x02), bytes([0x05, 0x00, 0x21, port, 0x02])),  # Mode combinations
+                    ] + [
+                        ((port, mode, info_type), bytes([0x06, 0x00, 0x22, port, mode, info_type]))
+                        for mode in range(8)  # Up to 8 modes typical
+                        for info_type in mode_info_types
+                    ]
+                    for port in all_ports
+                }
+                
                 for port, name in all_ports.items():
                     print(f"\n{'='*50}")
                     print(f"Analyzing Port 0x{port:02x} - {name}")
                     print(f"{'='*50}")
+                    probes = port_probes[port]
                     
-                    # 1. Query port capabilities
-                    print("\n1. Querying port capabilities...")
-                    cmd_bytes = bytes([0x05, 0x00, 0x21, port, 0x01])  # Port Value
-                    logger.debug(f"Port info request: {cmd_bytes.hex()}")
-                    await controller.client.write_gatt_char(CHARACTERISTIC_UUID, cmd_bytes)
-                    await asyncio.sleep(0.3)
+                    print("\nQuerying port capabilities, mode combinations and mode details...")
+                    if logger.isEnabledFor(logging.DEBUG):
+                        for (_, mode, info_type), cmd_bytes in probes:
+                            logger.debug("Port 0x%02x mode %s info 0x%02x: %s", port, mode, info_type, cmd_bytes.hex())
                     
-                    # 2. Query port mode combinations
-                    print("2. Querying mode combinations...")
-                    cmd_bytes = bytes([0x05, 0x00, 0x21, port, 0x02])  # Mode combinations
-                    logger.debug(f"Mode combinations: {cmd_bytes.hex()}")
-                    await controller.client.write_gatt_char(CHARACTERISTIC_UUID, cmd_bytes)
-                    await asyncio.sleep(0.3)
-                    
-                    # 3. Query each mode's details (up to 8 modes typical)
-                    print("3. Querying mode details...")
-                    for mode in range(8):
-                        # Get mode name
-                        cmd_bytes = bytes([0x06, 0x00, 0x22, port, mode, 0x00])
-                        logger.debug(f"Mode {mode} name: {cmd_bytes.hex()}")
-                        await controller.client.write_gatt_char(CHARACTERISTIC_UUID, cmd_bytes)
-                        await asyncio.sleep(0.2)
-                        
-                        # Get value format
-                        cmd_bytes = bytes([0x06, 0x00, 0x22, port, mode, 0x80])
-                        logger.debug(f"Mode {mode} format: {cmd_bytes.hex()}")
-                        await controller.client.write_gatt_char(CHARACTERISTIC_UUID, cmd_bytes)
-                        await asyncio.sleep(0.2)
-                        
-                        # Get RAW range
-                        cmd_bytes = bytes([0x06, 0x00, 0x22, port, mode, 0x01])
-                        logger.debug(f"Mode {mode} RAW range: {cmd_bytes.hex()}")
-                        await controller.client.write_gatt_char(CHARACTERISTIC_UUID, cmd_bytes)
-                        await asyncio.sleep(0.2)
-                        
-                        # Get SI range  
-                        cmd_bytes = bytes([0x06, 0x00, 0x22, port, mode, 0x03])
-                        logger.debug(f"Mode {mode} SI range: {cmd_bytes.hex()}")
-                        await controller.client.write_gatt_char(CHARACTERISTIC_UUID, cmd_bytes)
-                        await asyncio.sleep(0.2)
+                    # Send all probes back-to-back and wait for the responses
+                    answered = await controller.send_queries(probes)
+                    print(f"Received {answered}/{len(probes)} responses")
                     
                     print(f"\nCompleted analysis for port 0x{port:02x}")
                     print("Check debug logs for detailed responses!")
                     
                     # Pause between ports
                     if port != 0x36:  # Not the last port
-                        input("\nPress Enter to continue to next port...")
+                        await async_input("\nPress Enter to continue to next port...")
                 
                 print("\n\nFull port analysis complete!")
                 print("\nKey things to look for in the debug logs:")
@@ -647,24 +1291,36 @@ async def interactive_control(controller):
                 
                 # Subscribe to voltage sensor Mode 0 (VLT L)
                 # Format: [0x41=PortInputFormatSetupSingle, port, mode, delta, notification_enabled]
-                cmd_bytes = bytes([0x0A, 0x00, 0x41, 0x35, 0x00, 0x01, 0x00, 0x00, 0x00, 0x01])
-                logger.debug(f"Subscribe to voltage: {cmd_bytes.hex()}")
-                await controller.client.write_gatt_char(CHARACTERISTIC_UUID, cmd_bytes)
+                cmd_bytes = _SUB_V
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug("Subscribe to voltage: %s", cmd_bytes.hex())
+                await controller.client.write_gatt_char(controller.characteristic, cmd_bytes)
                 
-                print("\nVoltage readings will appear in debug log.")
-                print("Look for notifications with port 0x35")
+                print("\nVoltage readings are summarized about once per second")
                 print("Values are in millivolts (mV)")
                 print("\nReading for 30 seconds...")
                 
+                loop = asyncio.get_running_loop()
+                deadline = loop.time() + 30
+                controller.value_stream.clear()
                 try:
-                    await asyncio.sleep(30)
+                    async for batch in controller.drain_values():
+                        voltages = [
+                            int.from_bytes(value[:2], 'little')
+                            for port, value in batch
+                            if port == 0x35 and len(value) >= 2
+                        ]
+                        if voltages:
+                            print(f"Voltage: {voltages[-1]}mV ({len(voltages)} samples, "
+                                  f"min {min(voltages)}mV, max {max(voltages)}mV)")
+                        if loop.time() >= deadline:
+                            break
                 except KeyboardInterrupt:
                     pass
                 
                 # Unsubscribe
                 print("\nUnsubscribing from voltage updates...")
-                cmd_bytes = bytes([0x0A, 0x00, 0x41, 0x35, 0x00, 0x01, 0x00, 0x00, 0x00, 0x00])
-                await controller.client.write_gatt_char(CHARACTERISTIC_UUID, cmd_bytes)
+                await controller.client.write_gatt_char(controller.characteristic, _UNSUB_V)
                 
             elif cmd == 'C':
                 print("Reading color/motion sensor (Port 0x36) - Press Ctrl+C to stop")
@@ -673,7 +1329,7 @@ async def interactive_control(controller):
                 print("1 - COUNT (event counter)")
                 print("2 - VELO (velocity)")
                 
-                mode_input = input("Enter mode (0-2): ").strip()
+                mode_input = (await async_input("Enter mode (0-2): ")).strip()
                 try:
                     mode = int(mode_input)
                     if mode not in [0, 1, 2]:
@@ -688,8 +1344,9 @@ async def interactive_control(controller):
                 
                 # Subscribe to selected mode
                 cmd_bytes = bytes([0x0A, 0x00, 0x41, 0x36, mode, 0x01, 0x00, 0x00, 0x00, 0x01])
-                logger.debug(f"Subscribe to port 0x36 mode {mode}: {cmd_bytes.hex()}")
-                await controller.client.write_gatt_char(CHARACTERISTIC_UUID, cmd_bytes)
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug("Subscribe to port 0x36 mode %d: %s", mode, cmd_bytes.hex())
+                await controller.client.write_gatt_char(controller.characteristic, cmd_bytes)
                 
                 print(f"\n{mode_names[mode]} readings will appear in debug log.")
                 print("Look for notifications with port 0x36")
@@ -704,7 +1361,7 @@ async def interactive_control(controller):
                 # Unsubscribe
                 print("\nUnsubscribing from sensor updates...")
                 cmd_bytes = bytes([0x0A, 0x00, 0x41, 0x36, mode, 0x01, 0x00, 0x00, 0x00, 0x00])
-                await controller.client.write_gatt_char(CHARACTERISTIC_UUID, cmd_bytes)
+                await controller.client.write_gatt_char(controller.characteristic, cmd_bytes)
                 
             elif cmd == 'D':
                 print("Dual Sensor Monitoring - EVENTS Mode Test")
@@ -723,83 +1380,34 @@ async def interactive_control(controller):
                 print(f"Will test {total_tests} commands")
                 print("This will take approximately 20-30 minutes\n")
                 
-                # Initialize tracking with thread-safe collections
-                controller.voltage_baseline = None
-                controller.count_baseline = None
-                controller.last_5_commands = []
-                controller.last_200_commands = []  # For spacebar tracking (increased to 200)
-                controller.command_lock = threading.Lock()
-                voltage_changes = set()
-                motion_changes = set()
-                manual_events = []  # Commands when spacebar pressed
-                changes_lock = threading.Lock()
+                # Initialize tracking
+                controller.last_5_commands = collections.deque(maxlen=5)
+                controller.all_commands_sent = []  # Full sweep history, sliced for spacebar events
+                # One bit per command index, as with skip_bitmap below
+                voltage_bitmap = bytearray(8192)
+                motion_bitmap = bytearray(8192)
+                manual_events = []  # (start, end) history ranges when spacebar pressed
                 original_handler = controller.notification_handler  # Save original handler
+                writer = BatchedGattWriter(controller)  # Paced by the feedback the handler reports
                 
                 # Enhanced notification handler
-                notification_count = 0
-                def enhanced_handler(sender, data):
-                    nonlocal notification_count
-                    notification_count += 1
-                    controller.last_notification = data
-                    hex_data = data.hex()
-                    
-                    # Skip the motor feedback messages
-                    if hex_data.startswith("050082340a"):
-                        return
-                    
-                    # Debug first 10 non-motor notifications
-                    if notification_count <= 10:
-                        print(f"\nDEBUG [{notification_count}]: {hex_data}")
-                    
-                    # Check message type properly
-                    if len(data) >= 3:
-                        msg_type = data[2]
-                        if msg_type == 0x45:  # Port Value Single
-                            port = data[3]
-                            if port == 0x35 and len(data) >= 6:  # Voltage
-                                voltage = int.from_bytes(data[4:6], 'little')
-                                if controller.voltage_baseline is None:
-                                    controller.voltage_baseline = voltage
-                                    print(f"\nVoltage baseline set: {voltage}mV")
-                                elif abs(voltage - controller.voltage_baseline) > 100:  # 100mV threshold
-                                    print(f"\n>>> Voltage change: {voltage}mV (baseline: {controller.voltage_baseline}mV)")
-                                    # Add last 5 commands with thread safety
-                                    with controller.command_lock:
-                                        commands_copy = controller.last_5_commands.copy()
-                                    with changes_lock:
-                                        for cmd in commands_copy:
-                                            voltage_changes.add(cmd)
-                                            
-                            elif port == 0x36 and len(data) >= 8:  # Motion count
-                                count = int.from_bytes(data[4:8], 'little', signed=True)
-                                if controller.count_baseline is None:
-                                    controller.count_baseline = count
-                                    print(f"\nMotion baseline set: {count}")
-                                elif count != controller.count_baseline:
-                                    print(f"\n>>> Motion detected: count {controller.count_baseline} -> {count}")
-                                    # Add last 5 commands with thread safety
-                                    with controller.command_lock:
-                                        commands_copy = controller.last_5_commands.copy()
-                                    with changes_lock:
-                                        for cmd in commands_copy:
-                                            motion_changes.add(cmd)
-                                    controller.count_baseline = count
+                state = SweepState(controller, voltage_bitmap, motion_bitmap,
+                                   controller.last_5_commands, writer)
+                enhanced_handler = functools.partial(sweep_notification_handler, state)
                 
                 # Replace handler FIRST
-                await controller.client.stop_notify(CHARACTERISTIC_UUID)
-                await controller.client.start_notify(CHARACTERISTIC_UUID, enhanced_handler)
+                await controller.client.stop_notify(controller.characteristic)
+                await controller.client.start_notify(controller.characteristic, enhanced_handler)
                 await asyncio.sleep(0.5)
                 
                 # NOW subscribe to sensors with the new handler active
                 print("Subscribing to sensors...")
                 # Voltage sensor (port 0x35, mode 0)
-                cmd_bytes = bytes([0x0A, 0x00, 0x41, 0x35, 0x00, 0x01, 0x00, 0x00, 0x00, 0x01])
-                await controller.client.write_gatt_char(CHARACTERISTIC_UUID, cmd_bytes)
+                await controller.client.write_gatt_char(controller.characteristic, _SUB_V)
                 await asyncio.sleep(0.3)
                 
                 # Motion count sensor (port 0x36, mode 1 - COUNT)
-                cmd_bytes = bytes([0x0A, 0x00, 0x41, 0x36, 0x01, 0x01, 0x00, 0x00, 0x00, 0x01])
-                await controller.client.write_gatt_char(CHARACTERISTIC_UUID, cmd_bytes)
+                await controller.client.write_gatt_char(controller.characteristic, _SUB_M_COUNT)
                 await asyncio.sleep(0.5)
                 
                 # Get baseline readings
@@ -814,82 +1422,124 @@ async def interactive_control(controller):
                 disconnected = False
                 shutdown_commands = []
                 
+                # Every (event, volume) pair, indexed by event << 8 | volume like _events_table
+                ev_pairs = [(e, v) for e in range(256) for v in range(256)]
+                frames = _events_table()
+                frame_len = _EVENTS_FRAME_LEN
+                
+                # One bit per command index for the confirmed working commands
+                skip_bitmap = bytearray(8192)
+                for idx in skip_commands:
+                    skip_bitmap[idx >> 3] |= 1 << (idx & 7)
+                
+                # Let the loop wake us on keypresses instead of polling stdin
+                loop = asyncio.get_running_loop()
+                stdin_fd = sys.stdin.fileno()
+                spacebar_event = asyncio.Event()
+                def on_stdin():
+                    if b' ' in os.read(stdin_fd, 64):
+                        spacebar_event.set()
+                
+                def report_disconnect(in_flight, e):
+                    # A pipelined write fails at flush time, so blame the whole batch, not idx
+                    batch = controller.all_commands_sent[-in_flight:]
+                    (first_e, first_v), (last_e, last_v) = batch[0], batch[-1]
+                    print(f"\n>>> DISCONNECTION detected in batch Event={first_e}, Volume={first_v}"
+                          f" .. Event={last_e}, Volume={last_v}")
+                    print(f"Error: {e}")
+                    # Save last 20 commands before disconnection
+                    return controller.all_commands_sent[-20:]
+                
                 # Set stdin to non-blocking mode
                 old_settings = termios.tcgetattr(sys.stdin)
                 try:
-                    tty.setcbreak(sys.stdin.fileno())
+                    tty.setcbreak(stdin_fd)
+                    loop.add_reader(stdin_fd, on_stdin)
+                    
+                    # Hot-loop locals
+                    write = writer.write
+                    remember = controller.last_5_commands.append
+                    record = controller.all_commands_sent.append
+                    out = sys.stdout.write
                     
                     # Test in smaller batches to allow sensor processing
-                    for event in range(256):
-                        for volume in range(256):
-                            if disconnected:
-                                break
-                                
-                            # Skip confirmed working commands
-                            cmd_tuple = (event, volume)
-                            if cmd_tuple in skip_commands:
-                                continue
-                            with controller.command_lock:
-                                controller.last_5_commands.append(cmd_tuple)
-                                if len(controller.last_5_commands) > 5:
-                                    controller.last_5_commands.pop(0)
-                                controller.last_200_commands.append(cmd_tuple)
-                                if len(controller.last_200_commands) > 200:
-                                    controller.last_200_commands.pop(0)
-                            
-                            # Check for spacebar press (non-blocking)
-                            if select.select([sys.stdin], [], [], 0)[0]:
-                                key = sys.stdin.read(1)
-                                if key == ' ':
-                                    print(f"\n>>> MANUAL EVENT recorded at Event={event}, Volume={volume}")
-                                    with controller.command_lock:
-                                        manual_events.append(controller.last_200_commands.copy())
-                            
-                            # Send EVENTS command
-                            try:
-                                cmd_bytes = bytes([0x09, 0x00, 0x81, 0x34, 0x11, 0x51, 0x01, event, volume])
-                                await controller.client.write_gatt_char(CHARACTERISTIC_UUID, cmd_bytes, response=False)
-                            except Exception as e:
-                                print(f"\n>>> DISCONNECTION detected at Event={event}, Volume={volume}")
-                                print(f"Error: {e}")
-                                disconnected = True
-                                # Save last 20 commands before disconnection
-                                with controller.command_lock:
-                                    shutdown_commands = controller.last_200_commands[-20:]
-                                break
-                            
-                            # Give time for sensor readings and BLE notifications
-                            await asyncio.sleep(0.02)  # Increased delay
-                            
-                            test_count += 1
-                            if test_count % 500 == 0:
-                                # Longer pause every 500 commands to ensure processing
-                                await asyncio.sleep(0.5)
-                                progress = (test_count / total_tests) * 100
-                                print(f"\rProgress: {progress:.1f}%", end="", flush=True)
+                    for idx, cmd_tuple in enumerate(ev_pairs):
+                        # Skip confirmed working commands
+                        if skip_bitmap[idx >> 3] & (1 << (idx & 7)):
+                            continue
+                        remember(cmd_tuple)
+                        record(cmd_tuple)
                         
-                        if disconnected:
+                        # Check for spacebar press (non-blocking)
+                        if spacebar_event.is_set():
+                            spacebar_event.clear()
+                            print(f"\n>>> MANUAL EVENT recorded at Event={idx >> 8}, Volume={idx & 0xFF}")
+                            sent = len(controller.all_commands_sent)
+                            manual_events.append((max(0, sent - 200), sent))
+                        
+                        # Send EVENTS command (writer paces each batch for sensor readings)
+                        test_count += 1
+                        in_flight = len(writer.pending) + 1
+                        try:
+                            offset = idx * frame_len
+                            await write(frames[offset:offset + frame_len])
+                            if test_count % 500 == 0:
+                                in_flight = len(writer.pending)
+                                await writer.flush()
+                        except Exception as e:
+                            disconnected = True
+                            shutdown_commands = report_disconnect(in_flight, e)
                             break
+                        
+                        if test_count % 500 == 0:
+                            # Longer pause every 500 commands to ensure processing
+                            await asyncio.sleep(0.5)
+                            out(f"\rProgress: {test_count / total_tests * 100:.1f}%")
+                            sys.stdout.flush()
+                    
+                    if not disconnected and writer.pending:
+                        in_flight = len(writer.pending)
+                        try:
+                            await writer.flush()
+                        except Exception as e:
+                            disconnected = True
+                            shutdown_commands = report_disconnect(in_flight, e)
                             
                 finally:
                     # Restore terminal settings
+                    loop.remove_reader(stdin_fd)
                     termios.tcsetattr(sys.stdin, termios.TCSADRAIN, old_settings)
                 
                 print("\rProgress: 100.0%")
                 
+                # Start the file saves in worker threads so they overlap the BLE cleanup
+                manual_save = shutdown_save = None
+                if manual_events:
+                    manual_save = asyncio.create_task(asyncio.to_thread(
+                        _save_manual_events, controller.all_commands_sent, manual_events))
+                if shutdown_commands:
+                    shutdown_save = asyncio.create_task(asyncio.to_thread(
+                        _save_shutdown_commands, shutdown_commands))
+                
                 # Only try to restore handler and unsubscribe if still connected
                 if controller.client and controller.client.is_connected:
                     try:
                         # Restore original handler
-                        await controller.client.stop_notify(CHARACTERISTIC_UUID)
-                        await controller.client.start_notify(CHARACTERISTIC_UUID, original_handler)
+                        await controller.client.stop_notify(controller.characteristic)
+                        await controller.client.start_notify(controller.characteristic, original_handler)
                         
                         # Unsubscribe from sensors
                         print("\nUnsubscribing from sensors...")
-                        cmd_bytes = bytes([0x0A, 0x00, 0x41, 0x35, 0x00, 0x01, 0x00, 0x00, 0x00, 0x00])
-                        await controller.client.write_gatt_char(CHARACTERISTIC_UUID, cmd_bytes)
-                        cmd_bytes = bytes([0x0A, 0x00, 0x41, 0x36, 0x01, 0x01, 0x00, 0x00, 0x00, 0x00])
-                        await controller.client.write_gatt_char(CHARACTERISTIC_UUID, cmd_bytes)
+                        await asyncio.gather(
+                            controller.client.write_gatt_char(
+                                controller.characteristic,
+                                _UNSUB_V,
+                                response=controller.write_response),
+                            controller.client.write_gatt_char(
+                                controller.characteristic,
+                                _UNSUB_M_COUNT,
+                                response=controller.write_response),
+                        )
                     except Exception as e:
                         print(f"\nError during cleanup: {e}")
                 else:
@@ -900,41 +1550,38 @@ async def interactive_control(controller):
                 print("RESULTS")
                 print("=" * 60)
                 
+                # Bitmaps iterate in command order, so these are already sorted
+                voltage_changes = list(_bitmap_commands(voltage_bitmap))
+                motion_changes = list(_bitmap_commands(motion_bitmap))
+                
                 if voltage_changes:
                     print(f"\nCommands that caused VOLTAGE changes ({len(voltage_changes)} unique):")
-                    for event, volume in sorted(voltage_changes):
-                        print(f"  Event={event}, Volume={volume}")
-                        print(f"    bytes([0x09, 0x00, 0x81, 0x34, 0x11, 0x51, 0x01, 0x{event:02x}, 0x{volume:02x}])")
+                    print(_format_event_commands(voltage_changes))
                 
                 if motion_changes:
                     print(f"\nCommands that caused MOTION ({len(motion_changes)} unique):")
-                    for event, volume in sorted(motion_changes):
-                        print(f"  Event={event}, Volume={volume}")
-                        print(f"    bytes([0x09, 0x00, 0x81, 0x34, 0x11, 0x51, 0x01, 0x{event:02x}, 0x{volume:02x}])")
+                    print(_format_event_commands(motion_changes))
                 
                 # Commands in both
-                both = voltage_changes.intersection(motion_changes)
+                both = list(_bitmap_commands(bytes(v & m for v, m in zip(voltage_bitmap, motion_bitmap))))
                 if both:
                     print(f"\nCommands that caused BOTH voltage and motion changes ({len(both)}):")
-                    for event, volume in sorted(both):
-                        print(f"  Event={event}, Volume={volume}")
+                    print("\n".join(f"  Event={event}, Volume={volume}" for event, volume in both))
                 
                 # Manual events (spacebar pressed)
                 if manual_events:
                     print(f"\nMANUAL EVENTS recorded ({len(manual_events)} events):")
-                    for i, event_list in enumerate(manual_events):
+                    for i, (start, end) in enumerate(manual_events):
+                        event_list = controller.all_commands_sent[start:end]
                         print(f"\n  Manual Event {i+1} - Last 200 commands (showing last 20):")
-                        for j, (event, volume) in enumerate(event_list[-20:]):  # Show last 20 of each
-                            print(f"    [{j+1}] Event={event}, Volume={volume}")
+                        print("\n".join(
+                            f"    [{j+1}] Event={event}, Volume={volume}"
+                            for j, (event, volume) in enumerate(event_list[-20:])  # Show last 20 of each
+                        ))
                     
                     # Save manual events to file
                     try:
-                        with open("manual_events.txt", "w") as f:
-                            f.write("# Manual events - spacebar pressed during interesting commands\n")
-                            for i, event_list in enumerate(manual_events):
-                                f.write(f"\n# Manual Event {i+1} - Last 200 commands\n")
-                                for event, volume in event_list:
-                                    f.write(f"{event},{volume}\n")
+                        await manual_save
                         print("\nManual events saved to manual_events.txt")
                     except Exception as e:
                         print(f"\nError saving manual events: {e}")
@@ -942,17 +1589,16 @@ async def interactive_control(controller):
                 # Shutdown commands
                 if shutdown_commands:
                     print(f"\nSHUTDOWN COMMANDS (last 20 before disconnection):")
-                    for i, (event, volume) in enumerate(shutdown_commands):
-                        print(f"  [{i+1}] Event={event}, Volume={volume}")
-                        print(f"       bytes([0x09, 0x00, 0x81, 0x34, 0x11, 0x51, 0x01, 0x{event:02x}, 0x{volume:02x}])")
+                    print("\n".join(
+                        f"  [{i+1}] Event={event}, Volume={volume}\n"
+                        f"       bytes([0x09, 0x00, 0x81, 0x34, 0x11, 0x51, 0x01, 0x{_HEX2[event]}, 0x{_HEX2[volume]}])"
+                        for i, (event, volume) in enumerate(shutdown_commands)
+                    ))
                     
                 # Always save shutdown commands to file if we have them
                 if shutdown_commands:
                     try:
-                        with open("shutdown_commands.txt", "w") as f:
-                            f.write("# Shutdown commands - last 20 before disconnection\n")
-                            for i, (event, volume) in enumerate(shutdown_commands):
-                                f.write(f"{event},{volume}\n")
+                        await shutdown_save
                         print("\nShutdown commands saved to shutdown_commands.txt")
                     except Exception as e:
                         print(f"\nError saving shutdown commands: {e}")
@@ -969,33 +1615,24 @@ async def interactive_control(controller):
                 
                 try:
                     # Read events from file
-                    with open("manual_events.txt", "r") as f:
-                        lines = f.readlines()
+                    with open("manual_events.txt", "rb") as f:
+                        data = f.read()
                     
-                    # Parse all event,volume pairs
-                    all_events = []
-                    for line in lines:
-                        line = line.strip()
-                        if line and not line.startswith("#"):
-                            try:
-                                event, volume = line.split(",")
-                                all_events.append((int(event), int(volume)))
-                            except:
-                                continue
+                    # Parse all event,volume pairs that fit in a byte
+                    all_events = [
+                        (e, v) for e, v in ((int(e), int(v)) for e, v in _EVENT_LINE_RE.findall(data))
+                        if e < 256 and v < 256
+                    ]
                     
                     # Remove duplicates while preserving order
-                    seen = set()
-                    unique_events = []
-                    for ev in all_events:
-                        if ev not in seen:
-                            seen.add(ev)
-                            unique_events.append(ev)
+                    unique_events = dict.fromkeys(all_events)
                     
                     # Load and skip working commands
                     skip_commands = load_working_commands()
                     if skip_commands:
                         print(f"Loaded {len(skip_commands)} working commands to skip")
-                        unique_events = [ev for ev in unique_events if ev not in skip_commands]
+                        _drop_skipped(unique_events, skip_commands)
+                    unique_events = list(unique_events)
                     
                     if not unique_events:
                         print("No valid events found in manual_events.txt (after skipping working commands)")
@@ -1003,76 +1640,41 @@ async def interactive_control(controller):
                         continue
                     
                     print(f"Found {len(unique_events)} unique events to test")
-                    confirm = input("\nProceed? (y/n): ")
+                    confirm = await async_input("\nProceed? (y/n): ")
                     
-                    if confirm.lower() == 'y':
+                    if confirm in ('y', 'Y'):
                         # Initialize tracking
-                        controller.voltage_baseline = None
-                        controller.count_baseline = None
                         controller.command_history = []  # All commands tested
-                        controller.command_lock = threading.Lock()
-                        interesting_ranges = set()  # Store ranges of interesting commands
-                        voltage_changes = set()
-                        motion_changes = set()
-                        changes_lock = threading.Lock()
+                        # One flag per history index, so marked ranges come out in order
+                        interesting_flags = bytearray(len(unique_events))
+                        interesting_until = -1  # Last index still inside a marked range
+                        # Command bitmaps, iterated in sorted order at the end
+                        voltage_changes = bytearray(8192)
+                        motion_changes = bytearray(8192)
                         original_handler = controller.notification_handler
                         
                         # Enhanced notification handler
-                        def enhanced_handler(sender, data):
-                            controller.last_notification = data
-                            hex_data = data.hex()
-                            
-                            if hex_data.startswith("050082340a"):
-                                return
-                            
-                            if len(data) >= 3:
-                                msg_type = data[2]
-                                if msg_type == 0x45:  # Port Value Single
-                                    port = data[3]
-                                    if port == 0x35 and len(data) >= 6:  # Voltage
-                                        voltage = int.from_bytes(data[4:6], 'little')
-                                        if controller.voltage_baseline is None:
-                                            controller.voltage_baseline = voltage
-                                            print(f"\nVoltage baseline: {voltage}mV")
-                                        elif abs(voltage - controller.voltage_baseline) > 100:
-                                            print(f"\n>>> Voltage change: {voltage}mV (delta: {voltage - controller.voltage_baseline:+d})")
-                                            with controller.command_lock:
-                                                current_idx = len(controller.command_history) - 1
-                                            with changes_lock:
-                                                if current_idx >= 0:
-                                                    voltage_changes.add(controller.command_history[current_idx])
-                                                    
-                                    elif port == 0x36 and len(data) >= 8:  # Motion count
-                                        count = int.from_bytes(data[4:8], 'little', signed=True)
-                                        if controller.count_baseline is None:
-                                            controller.count_baseline = count
-                                            print(f"\nMotion baseline: {count}")
-                                        elif count != controller.count_baseline:
-                                            print(f"\n>>> Motion detected: {controller.count_baseline} -> {count}")
-                                            with controller.command_lock:
-                                                current_idx = len(controller.command_history) - 1
-                                            with changes_lock:
-                                                if current_idx >= 0:
-                                                    motion_changes.add(controller.command_history[current_idx])
-                                            controller.count_baseline = count
+                        state = SweepState(controller, voltage_changes, motion_changes,
+                                           controller.command_history)
+                        enhanced_handler = functools.partial(replay_notification_handler, state)
                         
                         # Replace handler and subscribe to sensors
-                        await controller.client.stop_notify(CHARACTERISTIC_UUID)
-                        await controller.client.start_notify(CHARACTERISTIC_UUID, enhanced_handler)
+                        await controller.client.stop_notify(controller.characteristic)
+                        await controller.client.start_notify(controller.characteristic, enhanced_handler)
                         await asyncio.sleep(0.5)
                         
                         print("Subscribing to sensors...")
                         # Voltage sensor
                         await controller.client.write_gatt_char(
-                            CHARACTERISTIC_UUID,
-                            bytes([0x0A, 0x00, 0x41, 0x35, 0x00, 0x01, 0x00, 0x00, 0x00, 0x01])
+                            controller.characteristic,
+                            _SUB_V
                         )
                         await asyncio.sleep(0.3)
                         
                         # Motion count sensor
                         await controller.client.write_gatt_char(
-                            CHARACTERISTIC_UUID,
-                            bytes([0x0A, 0x00, 0x41, 0x36, 0x01, 0x01, 0x00, 0x00, 0x00, 0x01])
+                            controller.characteristic,
+                            _SUB_M_COUNT
                         )
                         await asyncio.sleep(0.5)
                         
@@ -1082,40 +1684,49 @@ async def interactive_control(controller):
                         print("\nTesting events from manual_events.txt...")
                         print("Press SPACEBAR to mark interesting events\n")
                         
+                        # Let the loop wake us on keypresses instead of polling stdin
+                        loop = asyncio.get_running_loop()
+                        stdin_fd = sys.stdin.fileno()
+                        spacebar_event = asyncio.Event()
+                        def on_stdin():
+                            if b' ' in os.read(stdin_fd, 64):
+                                spacebar_event.set()
+                        
                         # Set stdin to non-blocking mode
                         old_settings = termios.tcgetattr(sys.stdin)
                         disconnected = False
                         
                         try:
-                            tty.setcbreak(sys.stdin.fileno())
+                            tty.setcbreak(stdin_fd)
+                            loop.add_reader(stdin_fd, on_stdin)
+                            
+                            # Hot-loop locals
+                            write = controller.client.write_gatt_char
+                            char = controller.characteristic
+                            sleep = asyncio.sleep
                             
                             for i, (event, volume) in enumerate(unique_events):
                                 if disconnected:
                                     break
                                 
                                 # Add to history
-                                with controller.command_lock:
-                                    controller.command_history.append((event, volume))
+                                controller.command_history.append((event, volume))
                                 
                                 print(f"[{i+1}/{len(unique_events)}] Testing Event={event}, Volume={volume}...", end="", flush=True)
                                 
                                 # Check for spacebar (non-blocking)
-                                if select.select([sys.stdin], [], [], 0)[0]:
-                                    key = sys.stdin.read(1)
-                                    if key == ' ':
-                                        print("\n>>> MARKED as interesting!")
-                                        with controller.command_lock:
-                                            current_idx = len(controller.command_history) - 1
-                                            # Add range from -5 to +5 (we'll catch the next 5 as we go)
-                                            start_idx = max(0, current_idx - 5)
-                                            for j in range(start_idx, min(current_idx + 6, len(unique_events))):
-                                                if j < len(controller.command_history):
-                                                    interesting_ranges.add(j)
+                                if spacebar_event.is_set():
+                                    spacebar_event.clear()
+                                    print("\n>>> MARKED as interesting!")
+                                    current_idx = len(controller.command_history) - 1
+                                    # Add range from -5 to +5 (we'll catch the next 5 as we go)
+                                    start = max(0, current_idx - 5)
+                                    interesting_flags[start:current_idx + 1] = b"\x01" * (current_idx + 1 - start)
+                                    interesting_until = max(interesting_until, current_idx + 5)
                                 
                                 # Send command
                                 try:
-                                    cmd_bytes = bytes([0x09, 0x00, 0x81, 0x34, 0x11, 0x51, 0x01, event, volume])
-                                    await controller.client.write_gatt_char(CHARACTERISTIC_UUID, cmd_bytes, response=False)
+                                    await write(char, _table_frame(event, volume), response=False)
                                 except Exception as e:
                                     print(f"\n>>> DISCONNECTION at Event={event}, Volume={volume}")
                                     print(f"Error: {e}")
@@ -1123,35 +1734,34 @@ async def interactive_control(controller):
                                     break
                                 
                                 # 0.1 second delay (10 commands per second)
-                                await asyncio.sleep(0.1)
+                                await sleep(0.1)
                                 
                                 # Add to interesting range if within 5 commands of a marked event
-                                with controller.command_lock:
-                                    current_idx = len(controller.command_history) - 1
-                                    for marked_idx in list(interesting_ranges):
-                                        if marked_idx <= current_idx <= marked_idx + 5:
-                                            interesting_ranges.add(current_idx)
+                                current_idx = len(controller.command_history) - 1
+                                if current_idx <= interesting_until:
+                                    interesting_flags[current_idx] = 1
                                 
                                 print(" done")
                                 
                         finally:
                             # Restore terminal settings
+                            loop.remove_reader(stdin_fd)
                             termios.tcsetattr(sys.stdin, termios.TCSADRAIN, old_settings)
                         
                         # Cleanup
                         if controller.client and controller.client.is_connected:
                             try:
-                                await controller.client.stop_notify(CHARACTERISTIC_UUID)
-                                await controller.client.start_notify(CHARACTERISTIC_UUID, original_handler)
+                                await controller.client.stop_notify(controller.characteristic)
+                                await controller.client.start_notify(controller.characteristic, original_handler)
                                 
                                 # Unsubscribe
                                 await controller.client.write_gatt_char(
-                                    CHARACTERISTIC_UUID,
-                                    bytes([0x0A, 0x00, 0x41, 0x35, 0x00, 0x01, 0x00, 0x00, 0x00, 0x00])
+                                    controller.characteristic,
+                                    _UNSUB_V
                                 )
                                 await controller.client.write_gatt_char(
-                                    CHARACTERISTIC_UUID,
-                                    bytes([0x0A, 0x00, 0x41, 0x36, 0x01, 0x01, 0x00, 0x00, 0x00, 0x00])
+                                    controller.characteristic,
+                                    _UNSUB_M_COUNT
                                 )
                             except Exception as e:
                                 print(f"\nCleanup error: {e}")
@@ -1162,42 +1772,43 @@ async def interactive_control(controller):
                         print("=" * 60)
                         
                         # Get interesting commands
-                        interesting_commands = []
-                        with controller.command_lock:
-                            for idx in sorted(interesting_ranges):
-                                if idx < len(controller.command_history):
-                                    interesting_commands.append(controller.command_history[idx])
+                        history = controller.command_history
+                        interesting_commands = [
+                            history[idx] for idx, flag in enumerate(interesting_flags)
+                            if flag and idx < len(history)
+                        ]
                         
                         if interesting_commands:
                             print(f"\nINTERESTING COMMANDS (spacebar pressed ±5):")
-                            seen_interesting = set()
-                            for event, volume in interesting_commands:
-                                if (event, volume) not in seen_interesting:
-                                    seen_interesting.add((event, volume))
-                                    print(f"  Event={event}, Volume={volume}")
-                                    if (event, volume) in voltage_changes:
-                                        print("    -> Caused voltage change")
-                                    if (event, volume) in motion_changes:
-                                        print("    -> Caused motion")
+                            seen_interesting = bytearray(8192)
+                            for event, volume in dict.fromkeys(interesting_commands):
+                                print(f"  Event={event}, Volume={volume}")
+                                if _bitmap_has(voltage_changes, event, volume):
+                                    print("    -> Caused voltage change")
+                                if _bitmap_has(motion_changes, event, volume):
+                                    print("    -> Caused motion")
+                            _mark_commands(seen_interesting, interesting_commands)
                             
                             # Save to file
                             try:
                                 with open("interesting_commands.txt", "w") as f:
                                     f.write("# Interesting commands marked during replay\n")
-                                    for event, volume in sorted(seen_interesting):
+                                    for event, volume in _bitmap_commands(seen_interesting):
                                         f.write(f"{event},{volume}\n")
                                 print("\nInteresting commands saved to interesting_commands.txt")
                             except Exception as e:
                                 print(f"\nError saving interesting commands: {e}")
                         
-                        if voltage_changes:
-                            print(f"\nCommands causing VOLTAGE changes ({len(voltage_changes)}):")
-                            for event, volume in sorted(voltage_changes):
+                        voltage_list = list(_bitmap_commands(voltage_changes))
+                        if voltage_list:
+                            print(f"\nCommands causing VOLTAGE changes ({len(voltage_list)}):")
+                            for event, volume in voltage_list:
                                 print(f"  Event={event}, Volume={volume}")
                         
-                        if motion_changes:
-                            print(f"\nCommands causing MOTION ({len(motion_changes)}):")
-                            for event, volume in sorted(motion_changes):
+                        motion_list = list(_bitmap_commands(motion_changes))
+                        if motion_list:
+                            print(f"\nCommands causing MOTION ({len(motion_list)}):")
+                            for event, volume in motion_list:
                                 print(f"  Event={event}, Volume={volume}")
                         
                         if disconnected:
@@ -1212,15 +1823,16 @@ async def interactive_control(controller):
             elif cmd == '7':
                 print("Testing Hub Action 0x07 with different values...")
                 print("WARNING: This action may reset/power off the train!")
-                confirm = input("Continue? (y/n): ")
-                if confirm.lower() == 'y':
+                confirm = await async_input("Continue? (y/n): ")
+                if confirm in ('y', 'Y'):
                     for value in range(0, 11):
                         print(f"\nTesting action 0x07 with value {value}...")
                         cmd_bytes = bytes([0x04, 0x00, 0x02, 0x07, value])
-                        logger.debug(f"Hub Action 0x07: {cmd_bytes.hex()}")
-                        await controller.client.write_gatt_char(CHARACTERISTIC_UUID, cmd_bytes)
+                        if logger.isEnabledFor(logging.DEBUG):
+                            logger.debug("Hub Action 0x07: %s", cmd_bytes.hex())
+                        await controller.client.write_gatt_char(controller.characteristic, cmd_bytes)
                         await asyncio.sleep(1)
-                        effect = input("Effect? (reset/power_off/sound/led/none): ")
+                        effect = await async_input("Effect? (reset/power_off/sound/led/none): ")
                         if effect in ["reset", "power_off"]:
                             print("Train reset/powered off. You may need to reconnect.")
                             break
@@ -1237,35 +1849,27 @@ async def interactive_control(controller):
                 
                 for filename in files_to_read:
                     try:
-                        with open(filename, "r") as f:
-                            lines = f.readlines()
-                            for line in lines:
-                                line = line.strip()
-                                if line and not line.startswith("#"):
-                                    try:
-                                        event, volume = line.split(",")
-                                        all_commands.append((int(event), int(volume)))
-                                    except:
-                                        continue
-                            print(f"Loaded commands from {filename}")
+                        data = await asyncio.to_thread(_read_command_file, filename)
+                        # Only event,volume pairs that fit in a byte can be framed
+                        all_commands.extend(
+                            (e, v) for e, v in ((int(e), int(v)) for e, v in _EVENT_LINE_RE.findall(data))
+                            if e < 256 and v < 256
+                        )
+                        print(f"Loaded commands from {filename}")
                     except FileNotFoundError:
                         print(f"File {filename} not found - skipping")
                     except Exception as e:
                         print(f"Error reading {filename}: {e}")
                 
                 # Remove duplicates while preserving order
-                seen = set()
-                unique_commands = []
-                for cmd in all_commands:
-                    if cmd not in seen:
-                        seen.add(cmd)
-                        unique_commands.append(cmd)
+                unique_commands = dict.fromkeys(all_commands)
                 
                 # Load and skip working commands
                 skip_commands = load_working_commands()
                 if skip_commands:
                     print(f"Loaded {len(skip_commands)} working commands to skip")
-                    unique_commands = [cmd for cmd in unique_commands if cmd not in skip_commands]
+                    _drop_skipped(unique_commands, skip_commands)
+                unique_commands = list(unique_commands)
                 
                 if not unique_commands:
                     print("\nNo commands found in any file (after skipping working commands)")
@@ -1273,11 +1877,14 @@ async def interactive_control(controller):
                 
                 print(f"\nFound {len(unique_commands)} unique commands to test")
                 print(f"Will test in batches of 10 commands")
-                confirm = input("Proceed? (y/n): ")
+                confirm = await async_input("Proceed? (y/n): ")
                 
-                if confirm.lower() == 'y':
+                if confirm in ('y', 'Y'):
                     possibly_working = []
                     batch_size = 10
+                    client = controller.client
+                    write = client.write_gatt_char
+                    char = controller.characteristic
                     
                     # Process in batches
                     for batch_start in range(0, len(unique_commands), batch_size):
@@ -1298,7 +1905,7 @@ async def interactive_control(controller):
                             print(f"[{batch_start+i+1}/{len(unique_commands)}] Testing Event={event}, Volume={volume}...")
                             
                             # Build and store the command
-                            cmd_bytes = bytes([0x09, 0x00, 0x81, 0x34, 0x11, 0x51, 0x01, event, volume])
+                            cmd_bytes = _events_frame(event, volume)
                             batch_commands.append({
                                 'event': event,
                                 'volume': volume,
@@ -1308,13 +1915,13 @@ async def interactive_control(controller):
                             
                             try:
                                 # Send command
-                                await controller.client.write_gatt_char(CHARACTERISTIC_UUID, cmd_bytes)
+                                await write(char, cmd_bytes)
                                 
                                 # Short delay between commands
                                 await asyncio.sleep(0.5)
                                 
                                 # Check if still connected
-                                if not controller.client.is_connected:
+                                if not client.is_connected:
                                     print(">>> TRAIN DISCONNECTED!")
                                     print(f">>> Disconnection at Event={event}, Volume={volume}")
                                     possibly_working.append({
@@ -1349,10 +1956,10 @@ async def interactive_control(controller):
                         
                         print("\nDid ANY of these commands have an effect on the train?")
                         print("(sound/movement/light/any effect)")
-                        response = input("\nAny effects? (y/n): ").strip().lower()
+                        response = (await async_input("\nAny effects? (y/n): ")).strip()
                         
-                        if response == 'y':
-                            effect_desc = input("Describe the effect(s) (optional): ").strip()
+                        if response in ('y', 'Y'):
+                            effect_desc = (await async_input("Describe the effect(s) (optional): ")).strip()
                             # Save all commands from this batch
                             for cmd in batch_commands:
                                 possibly_working.append({
@@ -1366,23 +1973,24 @@ async def interactive_control(controller):
                         # Pause between batches
                         if batch_end < len(unique_commands):
                             print(f"\nCompleted batch {batch_start//batch_size + 1}")
-                            input("Press Enter to continue to next batch...")
+                            await async_input("Press Enter to continue to next batch...")
                     
                     # Save possibly working commands
                     if possibly_working:
                         try:
-                            import datetime
-                            with open("possibly_working_commands.txt", "a") as f:  # Append mode
-                                f.write("\n# Possibly working commands - batch tested " + 
-                                       f"on {datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
-                                for cmd in possibly_working:
-                                    f.write(f"\n# Event={cmd['event']}, Volume={cmd['volume']}")
-                                    if cmd['effect']:
-                                        f.write(f" - Effect: {cmd['effect']}")
-                                    f.write(f"\n{cmd['bytes']}\n")
-                                    # Also write the command construction for reference
-                                    f.write(f"# bytes([0x09, 0x00, 0x81, 0x34, 0x11, 0x51, 0x01, ")
-                                    f.write(f"0x{cmd['event']:02x}, 0x{cmd['volume']:02x}])\n")
+                            parts = ["\n# Possibly working commands - batch tested "
+                                     f"on {datetime.datetime.now().isoformat(sep=' ', timespec='seconds')}\n"]
+                            for cmd in possibly_working:
+                                effect = f" - Effect: {cmd['effect']}" if cmd['effect'] else ""
+                                # Also write the command construction for reference
+                                parts.append(
+                                    f"\n# Event={cmd['event']}, Volume={cmd['volume']}{effect}\n"
+                                    f"{cmd['bytes']}\n"
+                                    f"# bytes([0x09, 0x00, 0x81, 0x34, 0x11, 0x51, 0x01, "
+                                    f"0x{_HEX2[cmd['event']]}, 0x{_HEX2[cmd['volume']]}])\n"
+                                )
+                            # Append the whole block off the event loop
+                            await asyncio.to_thread(_append_file, "possibly_working_commands.txt", "".join(parts))
                             
                             print(f"\n✅ Saved {len(possibly_working)} possibly working commands to possibly_working_commands.txt")
                             print("\nPossibly working commands summary:")
@@ -1403,27 +2011,28 @@ async def interactive_control(controller):
                 
                 try:
                     # Read working commands
-                    with open("working_commands.list", "r") as f:
-                        lines = f.readlines()
+                    data = await asyncio.to_thread(_read_command_file, _WORKING_COMMANDS_FILE)
                     
+                    # Commands are kept decoded, ready to send
                     commands = []
-                    for line in lines:
+                    for line in data.split(b"\n"):
                         line = line.strip()
-                        if line and not line.startswith("#"):
+                        if line and line[0] != 0x23:  # '#'
                             # Check if it's hex format (18 chars) or old format (event,volume)
-                            if len(line) == 18 and all(c in '0123456789abcdefABCDEF' for c in line):
-                                commands.append(line)
-                            elif ',' in line:
+                            if len(line) == 18:
+                                try:
+                                    commands.append(bytes.fromhex(line.decode("ascii")))
+                                except ValueError:
+                                    continue
+                            elif b',' in line:
                                 # Old format - convert to hex
                                 try:
-                                    event, volume = line.split(',')
-                                    event = int(event)
-                                    volume = int(volume)
-                                    cmd_bytes = bytes([0x09, 0x00, 0x81, 0x34, 0x11, 0x51, 0x01, event, volume])
-                                    commands.append(cmd_bytes.hex())
-                                    print(f"Converted old format: {event},{volume} -> {cmd_bytes.hex()}")
-                                except:
+                                    event, volume = map(int, line.split(b',', 1))
+                                    cmd_bytes = _EVENTS_PREFIX + bytes((event, volume))
+                                except ValueError:
                                     continue
+                                commands.append(cmd_bytes)
+                                print(f"Converted old format: {event},{volume} -> {cmd_bytes.hex()}")
                     
                     if not commands:
                         print("No valid commands found in working_commands.list")
@@ -1434,22 +2043,22 @@ async def interactive_control(controller):
                     
                     print(f"Found {len(commands)} working commands\n")
                     
-                    for i, hex_cmd in enumerate(commands):
-                        # Extract event and volume for display
-                        try:
-                            event = int(hex_cmd[14:16], 16)
-                            volume = int(hex_cmd[16:18], 16)
-                            print(f"\n[{i+1}/{len(commands)}] Command: Event={event}, Volume={volume}")
-                            print(f"Hex: {hex_cmd}")
-                        except:
-                            print(f"\n[{i+1}/{len(commands)}] Command: {hex_cmd}")
+                    # Everything shown or sent is prepared up front; the loop only prompts and writes.
+                    # Event and volume are the last two bytes (both formats decode to 9 bytes).
+                    decoded = [(cmd_bytes[7], cmd_bytes[8], cmd_bytes, cmd_bytes.hex()) for cmd_bytes in commands]
+                    write = controller.client.write_gatt_char
+                    char = controller.characteristic
+                    
+                    for i, (event, volume, cmd_bytes, hex_cmd) in enumerate(decoded):
+                        print(f"\n[{i+1}/{len(decoded)}] Command: Event={event}, Volume={volume}")
+                        print(f"Hex: {hex_cmd}")
                         
-                        input("\nPress Enter to send this command...")
+                        # Wait for Enter without blocking BLE notifications
+                        await async_input("\nPress Enter to send this command...")
                         
                         # Send command
                         try:
-                            cmd_bytes = bytes.fromhex(hex_cmd)
-                            await controller.client.write_gatt_char(CHARACTERISTIC_UUID, cmd_bytes)
+                            await write(char, cmd_bytes)
                             print("✓ Command sent")
                             
                             # Check if still connected
@@ -1476,30 +2085,24 @@ async def interactive_control(controller):
                 
                 try:
                     # Read possibly working commands
-                    with open("possibly_working_commands.txt", "r") as f:
-                        lines = f.readlines()
+                    data = await asyncio.to_thread(_read_command_file, "possibly_working_commands.txt")
                     
-                    # Parse unique commands
-                    seen = set()
-                    test_commands = []
-                    for line in lines:
+                    # Parse unique commands, keeping the first decoded command for each (event, volume)
+                    unique_cmds = {}
+                    for line in data.split(b"\n"):
                         line = line.strip()
                         # Look for hex command lines
-                        if line and not line.startswith("#") and len(line) == 18:  # hex command length
+                        if len(line) == 18 and line[0] != 0x23:  # hex command length, not a '#' comment
                             try:
-                                # Extract event and volume from the hex string
-                                # Format: 0900813411510107c8 where 07 is event, c8 is volume
-                                event = int(line[14:16], 16)
-                                volume = int(line[16:18], 16)
-                                if (event, volume) not in seen:
-                                    seen.add((event, volume))
-                                    test_commands.append({
-                                        'event': event,
-                                        'volume': volume,
-                                        'hex': line
-                                    })
-                            except:
+                                cmd_bytes = bytes.fromhex(line.decode("ascii"))
+                            except ValueError:
                                 continue
+                            # Format: 0900813411510107c8 where 07 is event, c8 is volume
+                            unique_cmds.setdefault((cmd_bytes[7], cmd_bytes[8]), cmd_bytes)
+                    test_commands = [
+                        {'event': event, 'volume': volume, 'bytes': cmd_bytes}
+                        for (event, volume), cmd_bytes in unique_cmds.items()
+                    ]
                     
                     if not test_commands:
                         print("No valid commands found in possibly_working_commands.txt")
@@ -1507,35 +2110,37 @@ async def interactive_control(controller):
                         continue
                     
                     print(f"Found {len(test_commands)} unique commands to verify")
-                    confirm = input("Proceed? (y/n): ")
+                    confirm = await async_input("Proceed? (y/n): ")
                     
-                    if confirm.lower() == 'y':
+                    if confirm in ('y', 'Y'):
                         confirmed_working = []
+                        client = controller.client
+                        write = client.write_gatt_char
+                        char = controller.characteristic
                         
                         for i, cmd in enumerate(test_commands):
                             print(f"\n[{i+1}/{len(test_commands)}] Testing Event={cmd['event']}, Volume={cmd['volume']}")
-                            print(f"Command: {cmd['hex']}")
+                            print(f"Command: {cmd['bytes'].hex()}")
                             
-                            # Send command
-                            cmd_bytes = bytes([0x09, 0x00, 0x81, 0x34, 0x11, 0x51, 0x01, cmd['event'], cmd['volume']])
-                            await controller.client.write_gatt_char(CHARACTERISTIC_UUID, cmd_bytes)
+                            # Send command exactly as it was saved
+                            await write(char, cmd['bytes'], response=controller.write_response)
                             
                             # Wait for effect
                             await asyncio.sleep(1.5)
                             
                             # Check if still connected
-                            if not controller.client.is_connected:
+                            if not client.is_connected:
                                 print(">>> TRAIN DISCONNECTED!")
-                                response = input("Was this the intended effect? (y/n): ")
-                                if response.lower() == 'y':
+                                response = await async_input("Was this the intended effect? (y/n): ")
+                                if response in ('y', 'Y'):
                                     confirmed_working.append((cmd['event'], cmd['volume']))
                                 break
                             
                             # Ask for confirmation
                             print("\nDid this command have the expected effect?")
-                            response = input("Confirm working? (y/n): ").strip().lower()
+                            response = (await async_input("Confirm working? (y/n): ")).strip()
                             
-                            if response == 'y':
+                            if response in ('y', 'Y'):
                                 confirmed_working.append((cmd['event'], cmd['volume']))
                                 print("✓ Confirmed as working")
                             else:
@@ -1544,29 +2149,14 @@ async def interactive_control(controller):
                         # Save confirmed working commands
                         if confirmed_working:
                             try:
-                                import datetime
-                                with open("working_commands.list", "w") as f:
-                                    f.write("# Confirmed working commands for Duplo train\n")
-                                    f.write(f"# Generated on {datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
-                                    f.write("#\n")
-                                    f.write("# Format: full hex command (18 characters)\n")
-                                    f.write("# Command structure: 0900813411510[event][volume]\n")
-                                    f.write("#   09 = message length\n")
-                                    f.write("#   00 = hub ID\n") 
-                                    f.write("#   81 = port output command\n")
-                                    f.write("#   34 = sound port\n")
-                                    f.write("#   11 = startup/completion info\n")
-                                    f.write("#   51 = write direct mode data\n")
-                                    f.write("#   01 = EVENTS mode\n")
-                                    f.write("#   [event] = event byte (hex)\n")
-                                    f.write("#   [volume] = volume byte (hex)\n")
-                                    f.write("#\n\n")
-                                    
-                                    for event, volume in confirmed_working:
-                                        # Build the full command
-                                        cmd_bytes = bytes([0x09, 0x00, 0x81, 0x34, 0x11, 0x51, 0x01, event, volume])
-                                        f.write(f"# Event={event} (0x{event:02x}), Volume={volume} (0x{volume:02x})\n")
-                                        f.write(f"{cmd_bytes.hex()}\n\n")
+                                # Header plus the full command for each entry, written off the event loop
+                                ts = datetime.datetime.now().isoformat(sep=' ', timespec='seconds')
+                                text = _WORKING_HEADER_TPL.format(ts=ts) + "".join(
+                                    f"# Event={event} (0x{_HEX2[event]}), Volume={volume} (0x{_HEX2[volume]})\n"
+                                    f"{_EVENTS_PREFIX_HEX}{_HEX2[event]}{_HEX2[volume]}\n\n"
+                                    for event, volume in confirmed_working
+                                )
+                                await asyncio.to_thread(_write_file, _WORKING_COMMANDS_FILE, text)
                                 
                                 print(f"\n✅ Saved {len(confirmed_working)} confirmed working commands to working_commands.list")
                                 print("\nConfirmed commands:")
@@ -1595,14 +2185,14 @@ async def interactive_control(controller):
                 total_tests = len(working_base) * 256
                 
                 print(f"\nTotal combinations: {total_tests} (5 commands × 256 values)")
-                print(f"Estimated time: ~{total_tests * 0.1 / 60:.1f} minutes at 0.1s per test")
+                print(f"Estimated time: ~{total_tests * 0.02 / 60:.1f} minutes at up to 0.02s per test")
                 
                 print("\nTest options:")
                 print("1. Quick test - Common values (0, 1, 10, 50, 100, 127, 200, 255)")
                 print("2. Full test - All 256 values")
                 print("3. Cancel")
                 
-                choice = input("\nSelect option (1-3): ")
+                choice = await async_input("\nSelect option (1-3): ")
                 
                 if choice == '1':
                     test_values = [0, 1, 5, 10, 25, 50, 75, 100, 127, 150, 200, 255]
@@ -1614,6 +2204,9 @@ async def interactive_control(controller):
                     continue
                 
                 results = []
+                client = controller.client
+                write = client.write_gatt_char
+                char = controller.characteristic
                 
                 for event, volume in working_base:
                     print(f"\n\nTesting base command ({event},{volume}) with third byte:")
@@ -1622,36 +2215,50 @@ async def interactive_control(controller):
                     
                     # First show what the 2-byte version does
                     print(f"Reminder - 2-byte ({event},{volume}) effect: ", end="")
-                    cmd_bytes = bytes([0x09, 0x00, 0x81, 0x34, 0x11, 0x51, 0x01, event, volume])
-                    await controller.client.write_gatt_char(CHARACTERISTIC_UUID, cmd_bytes)
+                    cmd_bytes = _events_frame(event, volume)
+                    await write(char, cmd_bytes)
                     await asyncio.sleep(1)
-                    base_effect = input("Describe base effect: ")
+                    base_effect = await async_input("Describe base effect: ")
                     
                     print(f"\nNow testing 3-byte format:")
                     tested_count = 0
+                    # Pipelined write-without-response, paced per window instead of per command
+                    writer = BatchedGattWriter(controller)
+                    out = sys.stdout.write
                     
                     for param in test_values:
                         # 3-byte command
-                        cmd_bytes = bytes([0x0A, 0x00, 0x81, 0x34, 0x11, 0x51, 0x01, event, volume, param])
                         try:
-                            await controller.client.write_gatt_char(CHARACTERISTIC_UUID, cmd_bytes)
-                            await asyncio.sleep(0.1)
+                            await writer.write(_events_frame(event, volume, param))
                             tested_count += 1
                             
-                            # Show progress
-                            if param in [0, 50, 100, 150, 200, 255]:
-                                print(f"  Progress: param={param}")
+                            # Show progress on one rewritten line
+                            out(f"\r  Progress: param={param:>3}")
+                            
+                            # Flush every 32 writes to surface errors and check the link
+                            if tested_count % 32 == 0:
+                                sys.stdout.flush()
+                                await writer.flush()
+                                if not client.is_connected:
+                                    print(f"\n  Disconnected at param {param}")
+                                    break
                                 
                         except Exception as e:
                             print(f"\n  Error at param {param}: {e}")
                             break
+                    else:
+                        sys.stdout.flush()
+                        try:
+                            await writer.flush()
+                        except Exception as e:
+                            print(f"\n  Error in final batch: {e}")
                     
                     print(f"\nTested {tested_count} values for ({event},{volume})")
-                    response = input("Did the 3rd byte change the effect? (y/n): ")
+                    response = await async_input("Did the 3rd byte change the effect? (y/n): ")
                     
-                    if response.lower() == 'y':
-                        describe = input("Describe the changes (e.g., 'speed control', 'volume control'): ")
-                        which_values = input("Which values had different effects? (comma-separated or 'all'): ")
+                    if response in ('y', 'Y'):
+                        describe = await async_input("Describe the changes (e.g., 'speed control', 'volume control'): ")
+                        which_values = await async_input("Which values had different effects? (comma-separated or 'all'): ")
                         
                         if which_values.lower() == 'all':
                             effects_found = [(param, describe) for param in test_values]
@@ -1687,8 +2294,8 @@ async def interactive_control(controller):
                             print(f"    ... and {len(r['param_effects'])-5} more")
                     
                     # Save results
-                    save = input("\nSave results to 3byte_commands.txt? (y/n): ")
-                    if save.lower() == 'y':
+                    save = await async_input("\nSave results to 3byte_commands.txt? (y/n): ")
+                    if save in ('y', 'Y'):
                         with open("3byte_commands.txt", "w") as f:
                             f.write("# 3-byte command discoveries\n")
                             f.write("# Format: base_event,base_volume,param\n\n")
@@ -1702,14 +2309,16 @@ async def interactive_control(controller):
                 else:
                     print("\n\nNo 3-byte effects found. The commands might be strictly 2-byte format.")
                     
-            elif cmd == 'B':
+            elif cmd == 'X':
                 print("Byte Format Testing - Events 0-10")
                 print("=" * 50)
                 print("\nTesting events 0-10 with 2-byte and 3-byte formats")
                 print("Excluding known working: (1,1), (2,1), (4,1), (6,1), (7,1)")
                 
-                # Load working commands to skip
-                skip_commands = {(1,1), (2,1), (4,1), (6,1), (7,1)}
+                # Known working commands to skip, as a bitmap indexed by event << 8 | volume
+                skip_commands = ((1,1), (2,1), (4,1), (6,1), (7,1))
+                skip_bitmap = bytearray(8192)
+                _mark_commands(skip_bitmap, skip_commands)
                 
                 # Calculate total combinations
                 events = list(range(11))  # 0-10
@@ -1733,7 +2342,7 @@ async def interactive_control(controller):
                 print("3. Selected 3-byte test (~30 minutes)")
                 print("4. Cancel")
                 
-                choice = input("\nSelect option (1-4): ")
+                choice = await async_input("\nSelect option (1-4): ")
                 
                 if choice == '1':
                     # Quick test with common values
@@ -1746,22 +2355,21 @@ async def interactive_control(controller):
                     # 2-byte format
                     print("\nTesting 2-byte format...")
                     for event in range(11):
-                        for volume in test_volumes:
-                            if (event, volume) in skip_commands:
-                                continue
-                            
-                            cmd_bytes = bytes([0x09, 0x00, 0x81, 0x34, 0x11, 0x51, 0x01, event, volume])
-                            await controller.client.write_gatt_char(CHARACTERISTIC_UUID, cmd_bytes)
-                            await asyncio.sleep(0.1)
+                        base = event << 8  # Low byte is the volume, so its bit is volume & 7
+                        await _burst_write(controller, (
+                            _table_frame(event, volume)
+                            for volume in test_volumes
+                            if not skip_bitmap[(base | volume) >> 3] & (1 << (volume & 7))
+                        ), delay=0.1, coalesce=False, window=1)  # One at a time, slow enough to tell volumes apart
                         
                         # Ask after each event
                         print(f"\nEvent {event} tested with volumes: {test_volumes}")
-                        response = input("Any effects? (y/n): ")
-                        if response.lower() == 'y':
-                            which = input("Which volumes worked? (comma-separated or 'all'): ")
+                        response = await async_input("Any effects? (y/n): ")
+                        if response in ('y', 'Y'):
+                            which = await async_input("Which volumes worked? (comma-separated or 'all'): ")
                             if which == 'all':
                                 for v in test_volumes:
-                                    if (event, v) not in skip_commands:
+                                    if not _bitmap_has(skip_bitmap, event, v):
                                         working_commands.append((event, v, "2-byte"))
                             else:
                                 try:
@@ -1778,17 +2386,18 @@ async def interactive_control(controller):
                         print(f"\nTesting Event {event} with 3-byte format:")
                         for volume in [1, 50, 100, 255]:  # Fewer volumes for 3-byte
                             for param in test_params:
-                                cmd_bytes = bytes([0x0A, 0x00, 0x81, 0x34, 0x11, 0x51, 0x01, event, volume, param])
+                                cmd_bytes = _events_frame(event, volume, param)
                                 try:
-                                    await controller.client.write_gatt_char(CHARACTERISTIC_UUID, cmd_bytes)
+                                    await controller.client.write_gatt_char(controller.characteristic, cmd_bytes)
+                                    # Settle after every write so an effect can be tied to its frame
                                     await asyncio.sleep(0.1)
                                 except Exception as e:
                                     print(f"Error with 3-byte format: {e}")
                                     break
                         
-                        response = input("Any effects with 3-byte format? (y/n): ")
-                        if response.lower() == 'y':
-                            details = input("Describe what worked: ")
+                        response = await async_input("Any effects with 3-byte format? (y/n): ")
+                        if response in ('y', 'Y'):
+                            details = await async_input("Describe what worked: ")
                             working_commands.append((event, -1, f"3-byte: {details}"))
                     
                     # Save results
@@ -1800,15 +2409,15 @@ async def interactive_control(controller):
                             else:
                                 print(f"  Event={event} ({format_type})")
                         
-                        save = input("\nSave to new_working_commands.txt? (y/n): ")
-                        if save.lower() == 'y':
-                            with open("new_working_commands.txt", "w") as f:
-                                f.write("# New working commands found\n")
-                                for event, volume, format_type in working_commands:
-                                    if volume >= 0:
-                                        f.write(f"{event},{volume} # {format_type}\n")
-                                    else:
-                                        f.write(f"{event} # {format_type}\n")
+                        save = await async_input("\nSave to new_working_commands.txt? (y/n): ")
+                        if save in ('y', 'Y'):
+                            lines = ["# New working commands found\n"]
+                            for event, volume, format_type in working_commands:
+                                if volume >= 0:
+                                    lines.append(f"{event},{volume} # {format_type}\n")
+                                else:
+                                    lines.append(f"{event} # {format_type}\n")
+                            await asyncio.to_thread(_write_file, "new_working_commands.txt", "".join(lines))
                             print("Saved to new_working_commands.txt")
                 
                 elif choice == '2':
@@ -1820,19 +2429,21 @@ async def interactive_control(controller):
                         print(f"\nTesting Event {event} with all volumes 0-255...")
                         has_effect = False
                         
-                        for volume in range(256):
-                            if (event, volume) in skip_commands:
-                                continue
-                            
-                            cmd_bytes = bytes([0x09, 0x00, 0x81, 0x34, 0x11, 0x51, 0x01, event, volume])
-                            await controller.client.write_gatt_char(CHARACTERISTIC_UUID, cmd_bytes)
-                            await asyncio.sleep(0.05)  # Faster for full test
-                            
-                            if volume % 50 == 0:
-                                print(f"  Progress: volume {volume}/255")
+                        # Pipelined write-without-response in 50-volume slices for progress
+                        base = event << 8
+                        sent = 0
+                        for start in range(0, 256, 50):
+                            end = min(start + 50, 256)
+                            sent += await _burst_write(controller, (
+                                _table_frame(event, volume)
+                                for volume in range(start, end)
+                                if not skip_bitmap[(base | volume) >> 3] & (1 << (volume & 7))
+                            ))
+                            print(f"  Progress: volume {end - 1}/255")
+                        print(f"  Sent {sent} volumes")
                         
-                        response = input(f"\nDid Event {event} have any effects? (y/n): ")
-                        if response.lower() == 'y':
+                        response = await async_input(f"\nDid Event {event} have any effects? (y/n): ")
+                        if response in ('y', 'Y'):
                             print("Run option 'D' with this specific event range to find exact volumes")
                 
             elif cmd == 'A':
@@ -1860,15 +2471,15 @@ async def interactive_control(controller):
                 print("\n3. Could these commands accept additional parameters?")
                 print("   Testing with longer messages...")
                 
-                confirm = input("\nProceed with testing? (y/n): ")
-                if confirm.lower() == 'y':
+                confirm = await async_input("\nProceed with testing? (y/n): ")
+                if confirm in ('y', 'Y'):
                     print("\nTesting standard format commands:")
                     for event, volume, desc in test_commands[:20]:  # First 20 only
                         print(f"\nTesting {desc}: Event={event}, Volume={volume}")
-                        cmd_bytes = bytes([0x09, 0x00, 0x81, 0x34, 0x11, 0x51, 0x01, event, volume])
-                        await controller.client.write_gatt_char(CHARACTERISTIC_UUID, cmd_bytes)
+                        cmd_bytes = _events_frame(event, volume)
+                        await controller.client.write_gatt_char(controller.characteristic, cmd_bytes, response=controller.write_response)
                         await asyncio.sleep(1)
-                        effect = input("Effect? (none/sound/move/light/other): ")
+                        effect = await async_input("Effect? (none/sound/move/light/other): ")
                         if effect != "none":
                             print(f"✓ Found: Event={event}, Volume={volume} -> {effect}")
                     
@@ -1877,117 +2488,83 @@ async def interactive_control(controller):
                     for event in [1, 2, 4, 6, 7]:
                         print(f"\nTesting Event={event} with extra parameter:")
                         # Try 3-byte format: event, param1, param2
+                        log_lines = []
                         for param in [0, 50, 100, 255]:
-                            cmd_bytes = bytes([0x0A, 0x00, 0x81, 0x34, 0x11, 0x51, 0x01, event, 1, param])
-                            print(f"  Event={event}, Mode=1, Param={param}")
+                            cmd_bytes = _events_frame(event, 1, param)
+                            if _VERBOSE:
+                                log_lines.append(f"  Event={event}, Mode=1, Param={param}: {cmd_bytes.hex()}")
                             try:
-                                await controller.client.write_gatt_char(CHARACTERISTIC_UUID, cmd_bytes)
+                                await controller.client.write_gatt_char(controller.characteristic, cmd_bytes, response=controller.write_response)
                                 await asyncio.sleep(0.5)
                             except Exception as e:
-                                print(f"  Error: {e}")
+                                log_lines.append(f"  Error: {e}")
+                        if log_lines:
+                            sys.stdout.write("\n".join(log_lines) + "\n")
                         
-                        effect = input("Any different effects with extra parameter? ")
+                        effect = await async_input("Any different effects with extra parameter? ")
                         if effect:
                             print(f"✓ Extended format works for Event={event}")
                 
-            elif cmd.startswith('F') and len(cmd) > 1 and cmd[1:].isdigit():
-                # Forward with speed parameter (was E1)
-                try:
-                    speed = int(cmd[1:])
-                    if 0 <= speed <= 255:
-                        cmd_bytes = bytes([0x0A, 0x00, 0x81, 0x34, 0x11, 0x51, 0x01, 1, 1, speed])
-                        await controller.client.write_gatt_char(CHARACTERISTIC_UUID, cmd_bytes)
-                        print(f"Forward with speed {speed}")
-                    else:
-                        print("Speed must be 0-255")
-                except ValueError:
-                    print("Invalid speed value")
-                    
-            elif cmd.startswith('B') and len(cmd) > 1 and cmd[1:].isdigit():
-                # Backward with speed parameter (was E2)
-                try:
-                    speed = int(cmd[1:])
-                    if 0 <= speed <= 255:
-                        cmd_bytes = bytes([0x0A, 0x00, 0x81, 0x34, 0x11, 0x51, 0x01, 2, 1, speed])
-                        await controller.client.write_gatt_char(CHARACTERISTIC_UUID, cmd_bytes)
-                        print(f"Backward with speed {speed}")
-                    else:
-                        print("Speed must be 0-255")
-                except ValueError:
-                    print("Invalid speed value")
-                    
-            elif cmd.startswith('C') and len(cmd) > 1 and cmd[1:].isdigit():
-                # Color/light control (was E4)
-                try:
-                    color = int(cmd[1:])
-                    if 0 <= color <= 24:
-                        cmd_bytes = bytes([0x0A, 0x00, 0x81, 0x34, 0x11, 0x51, 0x01, 4, 1, color])
-                        await controller.client.write_gatt_char(CHARACTERISTIC_UUID, cmd_bytes)
-                        print(f"Set color to {color}")
-                    else:
-                        print("Color must be 0-24")
-                except ValueError:
-                    print("Invalid color value")
-                    
-            elif cmd.startswith('S') and len(cmd) > 1 and cmd[1:].isdigit():
-                # Sound control (was E6)
-                try:
-                    sound = int(cmd[1:])
-                    if 0 <= sound <= 255:
-                        cmd_bytes = bytes([0x0A, 0x00, 0x81, 0x34, 0x11, 0x51, 0x01, 6, 1, sound])
-                        await controller.client.write_gatt_char(CHARACTERISTIC_UUID, cmd_bytes)
-                        print(f"Play sound {sound}")
-                    else:
-                        print("Sound must be 0-255")
-                except ValueError:
-                    print("Invalid sound value")
+            elif value_cmd and value_cmd[1] in _PARAM_COMMANDS and value_cmd[3] is None:
+                # F/B/C/S with a value: EVENTS (event, 1, value) (were E1, E2, E4, E6)
+                event, limit, action, name = _PARAM_COMMANDS[value_cmd[1]]
+                value = int(value_cmd[2])
+                if 0 <= value <= limit:
+                    await senders[event](value)
+                    print(f"{action} {value}")
+                else:
+                    print(f"{name} must be 0-{limit}")
                     
             elif cmd.startswith('E') and len(cmd) > 1:
                 # Handle E0, E1, E2... E10 commands
                 try:
-                    # Check if there's a space and parameter for E3 or E4
-                    parts = cmd.split()
-                    if len(parts) == 2 and parts[0] in ['E3', 'E4']:
-                        event_num = int(parts[0][1])
+                    # Only E<event>, plus a parameter for E3 or E4
+                    if value_cmd is None or value_cmd[1] != 'E' or (
+                        value_cmd[3] is not None and value_cmd[2] not in ('3', '4')
+                    ):
+                        raise ValueError(cmd)
+                    
+                    if value_cmd[3] is not None:
+                        event_num = int(value_cmd[2])
                         try:
-                            specific_param = int(parts[1])
+                            specific_param = int(value_cmd[3])
                             if 0 <= specific_param <= 255:
                                 # Test with specific parameter
                                 print(f"Testing Event {event_num} with specific 3rd byte: {specific_param}")
                                 print("=" * 50)
-                                cmd_bytes = bytes([0x0A, 0x00, 0x81, 0x34, 0x11, 0x51, 0x01, event_num, 1, specific_param])
                                 print(f"Sending: ({event_num},1,{specific_param})")
+                                cmd_bytes = await senders[event_num](specific_param)
                                 print(f"Hex: {cmd_bytes.hex()}")
                                 
-                                await controller.client.write_gatt_char(CHARACTERISTIC_UUID, cmd_bytes)
-                                
-                                effect = input("\nDescribe the effect (or Enter if none): ")
+                                effect = await async_input("\nDescribe the effect (or Enter if none): ")
                                 if effect:
                                     print(f"✓ Event {event_num} with param {specific_param}: {effect}")
-                                    save = input(f"Save to event_{event_num}_effects.txt? (y/n): ")
-                                    if save.lower() == 'y':
-                                        with open(f"event_{event_num}_effects.txt", "a") as f:
-                                            f.write(f"{event_num},1,{specific_param} # {effect}\n")
+                                    save = await async_input(f"Save to event_{event_num}_effects.txt? (y/n): ")
+                                    if save in ('y', 'Y'):
+                                        await asyncio.to_thread(
+                                            _append_file, f"event_{event_num}_effects.txt",
+                                            f"{event_num},1,{specific_param} # {effect}\n",
+                                        )
                                         print("Saved!")
                                 continue
                             else:
                                 print(f"Parameter must be 0-255, got {specific_param}")
                                 continue
                         except ValueError:
-                            print(f"Invalid parameter: {parts[1]}")
+                            print(f"Invalid parameter: {value_cmd[3]}")
                             continue
                     
                     # Normal E command processing
-                    event_num = int(cmd[1:])
+                    event_num = int(value_cmd[2])
                     if 0 <= event_num <= 10:
                         # Special handling for E7 - just send (7,1) without third byte
                         if event_num == 7:
                             print("Sending Event 7 (stop/brake)")
                             print("=" * 50)
-                            cmd_bytes = bytes([0x09, 0x00, 0x81, 0x34, 0x11, 0x51, 0x01, 7, 1])
+                            cmd_bytes = _CMD_STOP
                             print(f"Sending: (7,1)")
                             print(f"Hex: {cmd_bytes.hex()}")
-                            await controller.client.write_gatt_char(CHARACTERISTIC_UUID, cmd_bytes)
+                            await controller.client.write_gatt_char(controller.characteristic, cmd_bytes)
                             print("Command sent")
                             continue
                             
@@ -2007,35 +2584,69 @@ async def interactive_control(controller):
                             test_values = [0, 1, 5, 10, 25, 50, 75, 100, 127, 150, 200, 255]
                             print("Testing common values: 0, 1, 5, 10, 25, 50, 75, 100, 127, 150, 200, 255")
                         
-                        print("Press any key to test next value, or 'q' to skip to next event\n")
+                        print(f"Each value plays for {_E_DWELL:g}s: 'y' marks it, any other key skips ahead, 'q' quits\n")
                         found_effects = []
+                        marked = []
                         
-                        for i, param in enumerate(test_values):
-                            print(f"\n[{i+1}/{len(test_values)}] Testing ({event_num},1,{param})")
-                            print(f"Hex: 0a00813411510{event_num:01x}01{param:02x}")
+                        # Keys arrive from the loop while the sweep runs instead of blocking on input()
+                        loop = asyncio.get_running_loop()
+                        stdin_fd = sys.stdin.fileno()
+                        keys = asyncio.Queue()
+                        def on_stdin():
+                            for key in os.read(stdin_fd, 64).decode(errors="ignore").lower():
+                                keys.put_nowait(key)
+                        
+                        old_settings = termios.tcgetattr(sys.stdin)
+                        try:
+                            tty.setcbreak(stdin_fd)
+                            loop.add_reader(stdin_fd, on_stdin)
                             
-                            # Send 3-byte command
-                            cmd_bytes = bytes([0x0A, 0x00, 0x81, 0x34, 0x11, 0x51, 0x01, event_num, 1, param])
+                            write = controller.client.write_gatt_char
+                            char = controller.characteristic
+                            out = sys.stdout.write
+                            total = len(test_values)
                             
-                            try:
-                                await controller.client.write_gatt_char(CHARACTERISTIC_UUID, cmd_bytes)
+                            # Every frame of the sweep back to back, sliced per step
+                            frame_len = len(_EVENTS3_FRAME)
+                            frames = memoryview(b"".join(_events_frame(event_num, 1, p) for p in test_values))
+                            
+                            for i, param in enumerate(test_values):
+                                cmd_bytes = frames[i * frame_len:(i + 1) * frame_len]
+                                # One write per step; the raw frame only when asked for
+                                if _VERBOSE:
+                                    out(f"\n[{i+1}/{total}] Testing ({event_num},1,{param})\nHex: {cmd_bytes.hex()}\n")
+                                else:
+                                    out(f"\n[{i+1}/{total}] Testing ({event_num},1,{param})\n")
+                                sys.stdout.flush()
                                 
-                                # Wait for observation
-                                print("\nObserve the effect...")
-                                response = input("Press Enter for next, 'y' if interesting, 'q' to quit: ").strip().lower()
+                                # Send 3-byte command
+                                try:
+                                    await write(char, cmd_bytes)
+                                except Exception as e:
+                                    print(f"Error: {e}")
+                                    if not controller.client.is_connected:
+                                        print("Train disconnected!")
+                                        break
+                                    continue
                                 
-                                if response == 'q':
-                                    break
-                                elif response == 'y':
-                                    effect = input("Describe the effect: ")
-                                    found_effects.append((param, effect))
-                                    print(f"✓ Marked: param {param} -> {effect}")
-                                    
-                            except Exception as e:
-                                print(f"Error: {e}")
-                                if not controller.client.is_connected:
-                                    print("Train disconnected!")
+                                # Give the effect time to show; a keypress moves on early
+                                try:
+                                    key = await asyncio.wait_for(keys.get(), _E_DWELL)
+                                except asyncio.TimeoutError:
+                                    continue
+                                if key == 'q':
                                     break
+                                if key == 'y':
+                                    marked.append(param)
+                                    print(f"✓ Marked: param {param}")
+                        finally:
+                            loop.remove_reader(stdin_fd)
+                            termios.tcsetattr(sys.stdin, termios.TCSADRAIN, old_settings)
+                        
+                        # Describe the marked values once the sweep is done
+                        for param in marked:
+                            effect = await async_input(f"Describe the effect of ({event_num},1,{param}): ")
+                            found_effects.append((param, effect))
                         
                         # Summary for this event
                         if found_effects:
@@ -2045,14 +2656,15 @@ async def interactive_control(controller):
                                 print(f"  ({event_num},1,{param}) -> {effect}")
                             
                             # Save to file
-                            save = input("\nSave these findings? (y/n): ")
-                            if save.lower() == 'y':
+                            save = await async_input("\nSave these findings? (y/n): ")
+                            if save in ('y', 'Y'):
                                 filename = f"event_{event_num}_effects.txt"
-                                with open(filename, "w") as f:
-                                    f.write(f"# Event {event_num} 3-byte effects\n")
-                                    f.write(f"# Format: event,volume,param # effect\n\n")
-                                    for param, effect in found_effects:
-                                        f.write(f"{event_num},1,{param} # {effect}\n")
+                                text = (
+                                    f"# Event {event_num} 3-byte effects\n"
+                                    "# Format: event,volume,param # effect\n\n"
+                                    + "".join(f"{event_num},1,{param} # {effect}\n" for param, effect in found_effects)
+                                )
+                                await asyncio.to_thread(_write_file, filename, text)
                                 print(f"Saved to {filename}")
                         else:
                             print(f"\nNo effects found for Event {event_num}")
@@ -2068,57 +2680,66 @@ async def interactive_control(controller):
                 print("WARNING: These commands may cause the train to shut down!")
                 
                 try:
-                    with open("shutdown_commands.txt", "r") as f:
-                        lines = f.readlines()
+                    data = await asyncio.to_thread(_read_command_file, "shutdown_commands.txt")
                     
                     # Parse commands from file
-                    commands = []
-                    for line in lines:
-                        line = line.strip()
-                        if line and not line.startswith("#"):
-                            try:
-                                event, volume = line.split(",")
-                                commands.append((int(event), int(volume)))
-                            except:
-                                continue
+                    commands = [
+                        (e, v) for e, v in ((int(e), int(v)) for e, v in _EVENT_LINE_RE.findall(data))
+                        if e < 256 and v < 256
+                    ]
                     
                     if not commands:
                         print("No valid commands found in shutdown_commands.txt")
                         continue
                     
                     print(f"\nFound {len(commands)} commands to test")
-                    print("Each command will be tested with a 3-second delay")
-                    confirm = input("\nProceed? (y/n): ")
+                    print(f"Each command waits up to {_T_RESPONSE_TIMEOUT:g}s for a response, then {_T_SETTLE:g}s for a shutdown")
+                    confirm = await async_input("\nProceed? (y/n): ")
                     
-                    if confirm.lower() == 'y':
+                    if confirm in ('y', 'Y'):
+                        # Frames for every command, sliced from the shared table up front
+                        frames = [_table_frame(event, volume) for event, volume in commands]
+                        disconnected = controller.disconnected
+                        notified = controller.notification_event
                         for i, (event, volume) in enumerate(commands):
                             print(f"\nTesting command {i+1}/{len(commands)}: Event={event}, Volume={volume}")
-                            cmd_bytes = bytes([0x09, 0x00, 0x81, 0x34, 0x11, 0x51, 0x01, event, volume])
+                            cmd_bytes = frames[i]
                             print(f"  Command bytes: {cmd_bytes.hex()}")
                             
                             try:
-                                await controller.client.write_gatt_char(CHARACTERISTIC_UUID, cmd_bytes)
-                                await asyncio.sleep(0.5)  # Brief wait for response
+                                ring = controller.recent_notifications
+                                ring.clear()
+                                notified.clear()
+                                await controller.client.write_gatt_char(controller.characteristic, cmd_bytes)
+                                # Move on as soon as the hub answers instead of a fixed delay
+                                try:
+                                    await asyncio.wait_for(notified.wait(), _T_RESPONSE_TIMEOUT)
+                                except asyncio.TimeoutError:
+                                    pass
                                 
-                                # Log the response
-                                if controller.last_notification:
-                                    response = controller.last_notification.hex()
-                                    print(f"  Response: {response}")
-                                    result = controller.evaluate_response(f"Event={event}, Volume={volume}")
-                                    print(f"  {result}")
+                                # Log the responses to this command; raw hex only when asked for
+                                if ring:
+                                    if _VERBOSE:
+                                        for data in ring:
+                                            print(f"  Response: {data.hex()}")
+                                    _, verdict = _describe_response(bytes(ring[-1]))
+                                    print(f"  Event={event}, Volume={volume} - {verdict}")
                                 else:
                                     print("  No response received")
                                 
-                                # Check if still connected
-                                if not controller.client.is_connected:
+                                # Give a shutdown time to drop the link so it is blamed on this command
+                                try:
+                                    await asyncio.wait_for(disconnected.wait(), _T_SETTLE)
+                                except asyncio.TimeoutError:
+                                    pass
+                                
+                                # Check if still connected (flag set by the disconnect callback)
+                                if disconnected.is_set():
                                     print("\n>>> TRAIN DISCONNECTED!")
                                     print(f">>> Shutdown command found: Event={event}, Volume={volume}")
                                     print(f">>> Command bytes: {cmd_bytes.hex()}")
                                     break
                                 
-                                print(f"  Waiting 3 seconds before next command...")
-                                await asyncio.sleep(3)
-                                
                             except Exception as e:
                                 print(f"\n>>> Error or disconnection detected!")
                                 print(f">>> Likely shutdown command: Event={event}, Volume={volume}")
@@ -2163,35 +2784,65 @@ async def main():
             logger.error("Invalid selection")
             return
     
-    connected = await controller.connect(selected_train)
-    if not connected:
-        return
-    
+    # Short connection interval for the bulk sweeps; it is negotiated at connect time
+    old_conn_interval = tighten_conn_interval()
     try:
-        # Wait for initial device discovery
-        await asyncio.sleep(2)
-        
-        logger.info("Ready for commands!")
-        
-        await interactive_control(controller)
+        connected = await controller.connect(selected_train)
+        if not connected:
+            return
         
-    finally:
-        # Only try to stop and disconnect if still connected
-        if controller.client and controller.client.is_connected:
-            try:
-                await controller.stop()
-            except Exception as e:
-                logger.debug(f"Error stopping motor: {e}")
+        try:
+            # Wait for initial device discovery
+            await asyncio.sleep(2)
             
-            try:
-                await controller.disconnect()
-            except Exception as e:
-                logger.debug(f"Error disconnecting: {e}")
-        else:
-            logger.info("Train already disconnected")
+            logger.info("Ready for commands!")
+            
+            await interactive_control(controller)
+            
+        finally:
+            # Only try to stop and disconnect if still connected
+            if controller.client and controller.client.is_connected:
+                try:
+                    await controller.stop()
+                except Exception as e:
+                    logger.debug(f"Error stopping motor: {e}")
+                
+                try:
+                    await controller.disconnect()
+                except Exception as e:
+                    logger.debug(f"Error disconnecting: {e}")
+            else:
+                logger.info("Train already disconnected")
+    finally:
+        restore_conn_interval(old_conn_interval)
 
 if __name__ == "__main__":
+    # Use uvloop when available - lower per-callback overhead for BLE I/O
+    new_event_loop = asyncio.new_event_loop
+    if sys.platform != "win32":
+        try:
+            import uvloop
+            # Build the loop directly; uvloop.install() goes through the deprecated policy API
+            new_event_loop = uvloop.new_event_loop
+        except ImportError:
+            pass
+    
+    loop = new_event_loop()
+    # Eager tasks run inline until their first real suspension (Python 3.12+)
+    if hasattr(asyncio, "eager_task_factory"):
+        loop.set_task_factory(asyncio.eager_task_factory)
+    asyncio.set_event_loop(loop)
+    
+    main_task = loop.create_task(main())
     try:
-        asyncio.run(main())
+        loop.run_until_complete(main_task)
     except KeyboardInterrupt:
-        logger.info("Program interrupted")
\ No newline at end of file
+        # Let main() run its cleanup (stop motor, disconnect)
+        main_task.cancel()
+        try:
+            loop.run_until_complete(main_task)
+        except (asyncio.CancelledError, KeyboardInterrupt):
+            pass
+        logger.info("Program interrupted")
+    finally:
+        loop.close()
\ No newline at end of file
@@ -7,6 +7,10 @@ import tty
 import logging
 import json
 import os
+import functools
+import random
+import signal
+import time
 from bleak import BleakScanner, BleakClient
 from bleak.exc import BleakError
 
@@ -20,9 +24,41 @@ LEGO_MANUFACTURER_DATA = 0x0397
 SERVICE_UUID = "00001623-1212-efde-1623-785feabcd123"
 CHARACTERISTIC_UUID = "00001624-1212-efde-1623-785feabcd123"
 
+# Event command with 3-byte payload (event, 1, value) follows this prefix
+EVENT_COMMAND_PREFIX = bytes([0x0A, 0x00, 0x81, 0x34, 0x11, 0x51, 0x01])
+# Stop uses direct motor control, not events
+STOP_COMMAND = bytes([0x08, 0x00, 0x81, 0x32, 0x01, 0x51, 0x00, 0x00])
+# Activate hub: Hub Properties, button, enable updates (length prefix included)
+HUB_ACTIVATE_COMMAND = bytes([0x05, 0x00, 0x01, 0x02, 0x02])
+
 # Configuration file path
 CONFIG_FILE = "duplo_config.json"
 
+# Longest wait between connection attempts, in seconds
+MAX_RETRY_DELAY = 30
+
+def backoff_schedule(base_delay, cap=MAX_RETRY_DELAY):
+    """Doubling retry delays from base_delay up to cap; the last entry repeats"""
+    if base_delay <= 0:
+        return [0]
+    schedule = [min(base_delay, cap)]
+    while schedule[-1] < cap:
+        schedule.append(min(schedule[-1] * 2, cap))
+    return schedule
+
+def retry_delay(schedule, attempt):
+    """Delay before the next attempt, jittered to 50-150% so retries don't line up"""
+    return schedule[min(attempt, len(schedule) - 1)] * (0.5 + random.random())
+
+def _silent_notify(sender, data):
+    """Notification handler that ignores everything (toddler version)"""
+
+@functools.lru_cache(maxsize=1)
+def _load_config_cached(path, mtime):
+    """Parse the config file once per modification time"""
+    with open(path, 'r') as f:
+        return json.load(f)
+
 class DuploTrainToddlerController:
     def __init__(self):
         self.client = None
@@ -33,11 +69,69 @@ class DuploTrainToddlerController:
         self.current_sound = 0
         self.reconnecting = False
         
+        # Resolve config sections once instead of on every key press / reconnect
+        reconnect_config = self.config.get("reconnect_settings", {
+            "max_attempts": 10,
+            "retry_delay": 5
+        })
+        self._reconnect_max = reconnect_config["max_attempts"]
+        self._reconnect_delay = reconnect_config["retry_delay"]
+        self._backoff = backoff_schedule(self._reconnect_delay)
+        color_range = self.config.get("color_range", {"min": 0, "max": 23})
+        self._color_min = color_range["min"]
+        self._color_max = color_range["max"]
+        # Next color for cycle_color from each current color, skipping color_skip
+        self._next_color = self.build_color_cycle(self.config.get("color_skip", [0, 11, 16]))
+        sound_range = self.config.get("sound_range", {"min": 0, "max": 6})
+        self._sound_min = sound_range["min"]
+        self._sound_max = sound_range["max"]
+        
+        # Command frames built once: fixed ones per action, templates for color/sound
+        # (templates are copied when queued, so later presses can't change a pending frame)
+        # (None for configured actions without event/speed, which do nothing)
+        self._actions = self.config["actions"]
+        self._action_frames = {}
+        for name, action in self._actions.items():
+            event = action.get("event")
+            speed = action.get("speed")
+            if event is None or speed is None:
+                self._action_frames[name] = None
+            elif name == "STOP":
+                self._action_frames[name] = STOP_COMMAND
+            else:
+                self._action_frames[name] = EVENT_COMMAND_PREFIX + bytes([event, 1, speed])
+        # Horn is an event command too; event 7 (E7) with payload 1 unless configured
+        horn = self.config.get("horn", {"event": 7, "payload": 1})
+        self._horn_frame = EVENT_COMMAND_PREFIX + bytes([horn["event"], 1, horn["payload"]])
+        self._color_frame = bytearray(EVENT_COMMAND_PREFIX + bytes([4, 1, 0]))  # Last byte is the color
+        self._sound_frame = bytearray(EVENT_COMMAND_PREFIX + bytes([6, 1, 0]))  # Last byte is the sound
+        
+        # Key -> handler, with the uppercase fallback folded in: "q" finds a "Q" mapping
+        key_mappings = self.config["key_mappings"]
+        self._dispatch = {}
+        for key, action in key_mappings.items():
+            handler = self.resolve_action(action)
+            if handler:
+                self._dispatch[key] = handler
+                if not key_mappings.get(key.lower()):
+                    self._dispatch.setdefault(key.lower(), handler)
+        self.key_queue = asyncio.Queue()  # Keystrokes from the stdin reader
+        self._write_q = asyncio.Queue()  # Frames for the writer task
+        self._last_queued = None
+        self._writer_task = None
+        self._last_unassigned = None  # Last unassigned key reported, to quiet auto-repeat
+        self._last_color_sent = None  # Color the hub already shows, None until known
+        self._last_action = None  # Most recently sent motor action and its time.monotonic()
+        self._last_action_time = 0.0
+        self._last_print_time = 0.0  # Motor action prints, at most one per 100 ms
+        self._unprinted = 0
+        self._last_unassigned_time = 0.0
+        
     def load_config(self):
         """Load configuration from file"""
         try:
-            with open(CONFIG_FILE, 'r') as f:
-                return json.load(f)
+            # Cached per mtime, so only an edited file is parsed again
+            return _load_config_cached(CONFIG_FILE, os.path.getmtime(CONFIG_FILE))
         except FileNotFoundError:
             print(f"Configuration file {CONFIG_FILE} not found")
             print("Using default configuration")
@@ -63,25 +157,72 @@ class DuploTrainToddlerController:
             },
             "color_range": {"min": 0, "max": 23},
             "sound_range": {"min": 0, "max": 6},
+            "color_skip": [0, 11, 16],
+            "horn": {"event": 7, "payload": 1},
             "reconnect_settings": {
                 "max_attempts": 10,
                 "retry_delay": 5
             }
         }
         
+    def resolve_action(self, action):
+        """Coroutine function to run for a key's configured action, or None if unassigned"""
+        if not action:
+            return None
+        if action == "QUIT":
+            return self.quit
+        if action == "HORN":
+            return self.play_horn
+        if action == "COLOR":
+            return self.cycle_color
+        if action == "SOUND":
+            return self.cycle_sound
+        if action.startswith("COLOR_"):
+            # Direct color selection, parsed once here instead of on every press
+            try:
+                return functools.partial(self.set_color, int(action.split("_")[1]))
+            except (ValueError, IndexError):
+                return functools.partial(self.report_invalid_color, action)
+        return functools.partial(self.execute_motor_action, action)
+    
+    async def quit(self):
+        """QUIT key"""
+        print("\nQuitting")
+        self.running = False
+    
+    async def report_invalid_color(self, action):
+        """A COLOR_ action whose color isn't a number"""
+        print(f"Invalid color action: {action}")
+    
+    def build_color_cycle(self, skip_colors):
+        """Map every color 0..max to the next one cycle_color should pick"""
+        allowed = [c for c in range(self._color_min, self._color_max + 1) if c not in skip_colors]
+        cycle = {}
+        for color in range(self._color_max + 1):
+            if not allowed:
+                cycle[color] = color  # Nothing to cycle to
+                continue
+            next_color = color
+            while True:
+                next_color = (next_color + 1) % (self._color_max + 1)
+                if next_color < self._color_min:
+                    next_color = self._color_min
+                if next_color not in skip_colors:
+                    break
+            cycle[color] = next_color
+        return cycle
+    
     async def scan_for_train(self):
         """Scan for LEGO Duplo train"""
         print("Looking for train...")
-        devices = await BleakScanner.discover(timeout=10.0)
-        
-        for device in devices:
-            if device.metadata.get('manufacturer_data'):
-                for mfr_id in device.metadata['manufacturer_data']:
-                    if mfr_id == LEGO_MANUFACTURER_DATA:
-                        print(f"Found train: {device.name}")
-                        return device
-        
-        return None
+        # Stops at the first LEGO advertisement instead of always scanning the full 10 s
+        device = await BleakScanner.find_device_by_filter(
+            lambda device, adv: LEGO_MANUFACTURER_DATA in adv.manufacturer_data,
+            timeout=10.0
+        )
+        if device:
+            print(f"Found train: {device.name}")
+        return device
     
     async def connect(self, device):
         """Connect to the train"""
@@ -92,109 +233,142 @@ class DuploTrainToddlerController:
             await self.client.connect()
             print("Connected to train")
             
-            # Enable notifications (simplified version)
-            async def notification_handler(sender, data):
-                pass  # Silent handler for toddler version
-            
-            await self.client.start_notify(CHARACTERISTIC_UUID, notification_handler)
+            # Enable notifications (simplified version) while the hub is activated;
+            # the subscribe round trip hides inside the hub's 0.5 s settle time
+            notify = asyncio.create_task(self.client.start_notify(CHARACTERISTIC_UUID, _silent_notify))
+            try:
+                # Activate hub
+                await self.client.write_gatt_char(CHARACTERISTIC_UUID, HUB_ACTIVATE_COMMAND)
+                await asyncio.gather(notify, asyncio.sleep(0.5))
+            finally:
+                if not notify.done():
+                    notify.cancel()
             
-            # Activate hub
-            command = bytearray([0x01, 0x02, 0x02])  # Enable button updates
-            await self.send_command(command)
-            await asyncio.sleep(0.5)
+            # Fresh writer for this connection; frames queued for the old one are dropped
+            if self._writer_task:
+                self._writer_task.cancel()
+            self._write_q = asyncio.Queue()
+            self._last_queued = None
+            self._last_color_sent = None  # A reconnected hub may have reset its light
+            self._writer_task = asyncio.create_task(self._drain_writes())
             
             return True
         except BleakError as e:
             print("Could not connect to train")
             return False
     
-    async def send_command(self, command):
-        """Send command to train with length prefix"""
-        message = bytearray([len(command) + 2, 0x00]) + command
-        await self.client.write_gatt_char(CHARACTERISTIC_UUID, message)
+    def queue_frame(self, frame):
+        """Hand a frame to the writer task; a repeat of the frame still waiting is dropped"""
+        if frame == self._last_queued and not self._write_q.empty():
+            return  # Key repeat while the radio catches up
+        self._last_queued = frame
+        self._write_q.put_nowait(frame)
+    
+    async def _drain_writes(self):
+        """Writer task: send queued frames without waiting for a write response"""
+        while True:
+            frame = await self._write_q.get()
+            try:
+                await self.client.write_gatt_char(CHARACTERISTIC_UUID, frame, response=False)
+            except Exception as e:
+                # The control loop notices the lost connection and reconnects
+                logger.error("Write failed: %s", e)
+    
+    async def shutdown(self):
+        """Stop the writer, stop the train and disconnect"""
+        if self._writer_task:
+            self._writer_task.cancel()
+            self._writer_task = None
+        if self.client and self.client.is_connected:
+            # Send stop command before disconnecting, waiting for it to go out
+            stop_frame = self._action_frames.get("STOP")
+            if stop_frame:
+                await self.client.write_gatt_char(CHARACTERISTIC_UUID, stop_frame)
+                print("Executing: STOP")
+            await self.client.disconnect()
+            print("Disconnected from train")
     
     async def execute_motor_action(self, action_name):
         """Execute a motor action from config"""
-        if action_name not in self.config["actions"]:
+        try:
+            cmd_bytes = self._action_frames[action_name]
+        except KeyError:
             print(f"Unknown action: {action_name}")
             return
-            
-        action = self.config["actions"][action_name]
-        if "event" in action and "speed" in action:
-            if action_name == "STOP":
-                # Stop uses direct motor control, not events
-                cmd_bytes = bytes([0x08, 0x00, 0x81, 0x32, 0x01, 0x51, 0x00, 0x00])
-            else:
-                # Forward/Backward use event format with 3-byte payload: event, 1, speed
-                cmd_bytes = bytes([0x0A, 0x00, 0x81, 0x34, 0x11, 0x51, 0x01, 
-                                  action["event"], 1, action["speed"]])
-            await self.client.write_gatt_char(CHARACTERISTIC_UUID, cmd_bytes)
-            print(f"Executing: {action_name}")
+        if cmd_bytes is None:
+            return  # Configured, but not a motor action
+        
+        # Key auto-repeat resends the same action ~25 times a second; keep repeats
+        # as keep-alives but drop the ones arriving within 50 ms of the last send
+        now = time.monotonic()
+        if action_name == self._last_action and now - self._last_action_time < 0.05:
+            return
+        self._last_action = action_name
+        self._last_action_time = now
+        
+        self.queue_frame(cmd_bytes)
+        
+        # Keep the TTY from becoming the bottleneck while keys are mashed
+        if now - self._last_print_time < 0.1:
+            self._unprinted += 1
+            return
+        more = f" (+{self._unprinted} more)" if self._unprinted else ""
+        print(f"Executing: {action_name}{more}")
+        self._last_print_time = now
+        self._unprinted = 0
     
     async def play_horn(self):
         """Play horn sound"""
-        # Use event 7 for horn (E7)
-        cmd_bytes = bytes([0x0A, 0x00, 0x81, 0x34, 0x11, 0x51, 0x01, 7, 1, 1])
-        await self.client.write_gatt_char(CHARACTERISTIC_UUID, cmd_bytes)
+        self.queue_frame(self._horn_frame)
         print("Horn!")
     
     async def set_color(self, color):
         """Set a specific color"""
-        color_range = self.config.get("color_range", {"min": 0, "max": 23})
-        if color < color_range["min"] or color > color_range["max"]:
-            print(f"Color {color} out of range ({color_range['min']}-{color_range['max']})")
+        if color < self._color_min or color > self._color_max:
+            print(f"Color {color} out of range ({self._color_min}-{self._color_max})")
             return
         
         self.current_color = color
-        # Use event-based command for color (event 4, 1, color)
-        cmd_bytes = bytes([0x0A, 0x00, 0x81, 0x34, 0x11, 0x51, 0x01, 4, 1, self.current_color])
-        await self.client.write_gatt_char(CHARACTERISTIC_UUID, cmd_bytes)
-        print(f"Color: {self.current_color}")
+        self.send_color()
     
     async def cycle_color(self):
-        """Cycle through colors, skipping 0, 11, and 16"""
-        color_range = self.config.get("color_range", {"min": 0, "max": 23})
-        skip_colors = [0, 11, 16]
-        
-        # Find next color that's not in skip list
-        next_color = self.current_color
-        while True:
-            next_color = (next_color + 1) % (color_range["max"] + 1)
-            if next_color < color_range["min"]:
-                next_color = color_range["min"]
-            if next_color not in skip_colors:
-                break
-        
-        self.current_color = next_color
+        """Cycle through colors, skipping the color_skip list (0, 11 and 16 by default)"""
+        self.current_color = self._next_color.get(self.current_color, self._color_min)
+        self.send_color()
+    
+    def send_color(self):
+        """Send current_color unless the hub is already showing it"""
+        if self.current_color == self._last_color_sent:
+            return
+        self._last_color_sent = self.current_color
         # Use event-based command for color (event 4, 1, color)
-        cmd_bytes = bytes([0x0A, 0x00, 0x81, 0x34, 0x11, 0x51, 0x01, 4, 1, self.current_color])
-        await self.client.write_gatt_char(CHARACTERISTIC_UUID, cmd_bytes)
+        self._color_frame[9] = self.current_color
+        self.queue_frame(bytes(self._color_frame))
         print(f"Color: {self.current_color}")
     
     async def cycle_sound(self):
         """Cycle through sounds"""
-        sound_range = self.config.get("sound_range", {"min": 0, "max": 6})
-        
         # Increment and wrap around correctly (0-6)
         self.current_sound = (self.current_sound + 1)
-        if self.current_sound > sound_range["max"]:
-            self.current_sound = sound_range["min"]
+        if self.current_sound > self._sound_max:
+            self.current_sound = self._sound_min
         
         # Use event-based command for sound (event 6, 1, sound_variation)
-        cmd_bytes = bytes([0x0A, 0x00, 0x81, 0x34, 0x11, 0x51, 0x01, 6, 1, self.current_sound])
-        await self.client.write_gatt_char(CHARACTERISTIC_UUID, cmd_bytes)
+        self._sound_frame[9] = self.current_sound
+        self.queue_frame(bytes(self._sound_frame))
         print(f"Sound: {self.current_sound} (sending 6,1,{self.current_sound})")
     
-    def getch(self):
-        """Get single character from terminal"""
+    def on_stdin(self):
+        """Queue the characters waiting on stdin (called by the event loop)"""
         fd = sys.stdin.fileno()
-        old_settings = termios.tcgetattr(fd)
-        try:
-            tty.setraw(sys.stdin.fileno())
-            ch = sys.stdin.read(1)
-        finally:
-            termios.tcsetattr(fd, termios.TCSADRAIN, old_settings)
-        return ch
+        data = os.read(fd, 32)
+        if not data:
+            # stdin closed
+            asyncio.get_running_loop().remove_reader(fd)
+            self.running = False
+            return
+        for ch in data.decode(errors="ignore"):
+            self.key_queue.put_nowait(ch)
     
     async def run_interactive(self):
         """Run the interactive control loop"""
@@ -204,6 +378,35 @@ class DuploTrainToddlerController:
         for key, action in self.config["key_mappings"].items():
             print(f"  {key} = {action}")
         
+        # Raw keys for the whole session, read by the event loop so BLE keeps running
+        loop = asyncio.get_running_loop()
+        fd = sys.stdin.fileno()
+        old_settings = termios.tcgetattr(fd)
+        # Raw mode turns Ctrl-C into a key, but kill/hangup would skip the restore below
+        stop_signals = (signal.SIGTERM, signal.SIGHUP)
+        for sig in stop_signals:
+            loop.add_signal_handler(sig, self.stop)
+        try:
+            tty.setraw(fd)
+            # Keep output processing so prints still start at the left margin
+            mode = termios.tcgetattr(fd)
+            mode[1] |= termios.OPOST
+            termios.tcsetattr(fd, termios.TCSANOW, mode)
+            loop.add_reader(fd, self.on_stdin)
+            await self.control_loop()
+        finally:
+            loop.remove_reader(fd)
+            termios.tcsetattr(fd, termios.TCSADRAIN, old_settings)
+            for sig in stop_signals:
+                loop.remove_signal_handler(sig)
+    
+    def stop(self):
+        """End the session; the control loop exits within its 0.5 s key timeout"""
+        print("\nStopping")
+        self.running = False
+    
+    async def control_loop(self):
+        """Handle keys until quit"""
         while self.running:
             try:
                 # Check connection
@@ -213,8 +416,11 @@ class DuploTrainToddlerController:
                         await self.handle_reconnection()
                     continue
                 
-                # Check for keyboard input
-                char = self.getch()
+                # Wait for a key, waking up to re-check the connection
+                try:
+                    char = await asyncio.wait_for(self.key_queue.get(), timeout=0.5)
+                except asyncio.TimeoutError:
+                    continue
                 
                 # # Check for ESC key (ASCII 27)
                 # if ord(char) == 27:
@@ -222,49 +428,34 @@ class DuploTrainToddlerController:
                 #     self.running = False
                 #     break
                 
-                # Look up action in config
-                action = self.config["key_mappings"].get(char)
-                if not action:
-                    action = self.config["key_mappings"].get(char.upper())
+                # Look up the key's handler, resolved from config at startup
+                handler = self._dispatch.get(char)
                 
-                if action == "QUIT":
-                    print("\nQuitting")
-                    self.running = False
-                    break
-                elif action == "HORN":
-                    await self.play_horn()
-                elif action == "COLOR":
-                    await self.cycle_color()
-                elif action == "SOUND":
-                    await self.cycle_sound()
-                elif action and action.startswith("COLOR_"):
-                    # Handle direct color selection
-                    try:
-                        color_value = int(action.split("_")[1])
-                        await self.set_color(color_value)
-                    except (ValueError, IndexError):
-                        print(f"Invalid color action: {action}")
-                elif action:
-                    await self.execute_motor_action(action)
+                if handler:
+                    await handler()
                 else:
-                    # Print the character value for unassigned keys
-                    print(f"Unassigned key: '{char}' (value: {ord(char)})")
+                    # Print the character value for unassigned keys, once per 0.5 s while held
+                    now = time.monotonic()
+                    if char != self._last_unassigned or now - self._last_unassigned_time > 0.5:
+                        print(f"Unassigned key: '{char}' (value: {ord(char)})")
+                        self._last_unassigned_time = now
+                    self._last_unassigned = char
                     
             except Exception as e:
-                logger.error(f"Error in control loop: {e}")
+                logger.error("Error in control loop: %s", e)
                 if not self.client or not self.client.is_connected:
                     await self.handle_reconnection()
     
     async def handle_reconnection(self):
         """Handle automatic reconnection"""
         self.reconnecting = True
-        reconnect_config = self.config.get("reconnect_settings", {
-            "max_attempts": 10,
-            "retry_delay": 5
-        })
         
-        for attempt in range(reconnect_config["max_attempts"]):
-            print(f"\nReconnection attempt {attempt + 1}/{reconnect_config['max_attempts']}")
+        for attempt in range(self._reconnect_max):
+            if not self.running:
+                # Stopped while reconnecting
+                self.reconnecting = False
+                return
+            print(f"\nReconnection attempt {attempt + 1}/{self._reconnect_max}")
             print("Trying to reconnect...")
             
             # Try to find the train again
@@ -275,9 +466,10 @@ class DuploTrainToddlerController:
                     self.reconnecting = False
                     return
             
-            if attempt < reconnect_config["max_attempts"] - 1:
-                print(f"Waiting {reconnect_config['retry_delay']} seconds before next attempt")
-                await asyncio.sleep(reconnect_config["retry_delay"])
+            if attempt < self._reconnect_max - 1:
+                delay = retry_delay(self._backoff, attempt)
+                print(f"Waiting {delay:.1f} seconds before next attempt")
+                await asyncio.sleep(delay)
         
         print("Failed to reconnect after all attempts")
         self.running = False
@@ -293,6 +485,8 @@ async def main():
         "retry_delay": 2
     })
     
+    backoff = backoff_schedule(reconnect_config["retry_delay"])
+    
     connected = False
     for attempt in range(reconnect_config["max_attempts"]):
         print(f"\nConnection attempt {attempt + 1}/{reconnect_config['max_attempts']}")
@@ -308,8 +502,9 @@ async def main():
             print("No train found. Make sure it is turned on")
         
         if attempt < reconnect_config["max_attempts"] - 1:
-            print(f"Waiting {reconnect_config['retry_delay']} seconds before next attempt")
-            await asyncio.sleep(reconnect_config["retry_delay"])
+            delay = retry_delay(backoff, attempt)
+            print(f"Waiting {delay:.1f} seconds before next attempt")
+            await asyncio.sleep(delay)
     
     if not connected:
         print("Failed to connect after all attempts")
@@ -319,14 +514,8 @@ async def main():
         # Run interactive control
         await controller.run_interactive()
     finally:
-        # Disconnect
-        if controller.client and controller.client.is_connected:
-            # Send stop command before disconnecting
-            stop_action = controller.config["actions"].get("STOP")
-            if stop_action:
-                await controller.execute_motor_action("STOP")
-            await controller.client.disconnect()
-            print("Disconnected from train")
+        # Stop and disconnect
+        await controller.shutdown()
 
 if __name__ == "__main__":
     try: